@@ -0,0 +1,98 @@
+import hashlib
+import logging
+import marshal
+import os
+import tempfile
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+
+def get_yaml_loader():
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def write_atomic(filename, data, mode=None):
+    directory = os.path.dirname(filename)
+    handle, tmpname = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'wb') as h:
+            h.write(data)
+        if mode is not None:
+            os.chmod(tmpname, mode)
+        os.rename(tmpname, filename)
+    except Exception:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+class YAMLCache(object):
+    """Parsed yaml documents cached on disk.
+
+    A cached document is used while the file has the same path, mtime
+    and content hash, so editing a schema invalidates its entry. Entries
+    are stored with marshal, loading them never creates objects other
+    than plain data, documents marshal can not store are not cached.
+    """
+    default = None
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def load(self, filename):
+        with open(filename) as h:
+            content = h.read()
+        if self.directory is None:
+            return yaml.load(content, Loader=get_yaml_loader())
+
+        filename = os.path.abspath(filename)
+        key = (filename, os.path.getmtime(filename),
+               hashlib.sha1(content).hexdigest())
+        path = self.get_path(filename)
+        cached = self.read(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        logger.debug('parsing %s', filename)
+        data = yaml.load(content, Loader=get_yaml_loader())
+        self.write(path, (key, data))
+        return data
+
+    def get_path(self, filename):
+        return os.path.join(
+            self.directory, '%s.cache' % hashlib.sha1(filename).hexdigest())
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as h:
+                record = marshal.loads(h.read())
+        except IOError:
+            return None
+        except (EOFError, ValueError, TypeError), e:
+            logger.warn('broken cache file %s: %s', path, e)
+            return None
+        if not isinstance(record, tuple) or len(record) != 2:
+            logger.warn('broken cache file %s', path)
+            return None
+        return record
+
+    def write(self, path, record):
+        try:
+            data = marshal.dumps(record)
+        except ValueError, e:
+            logger.debug('could not cache %s: %s', record[0][0], e)
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0700)
+            write_atomic(path, data)
+        except (IOError, OSError), e:
+            logger.warn('could not write cache file %s: %s', path, e)
+
+
+def load_yaml(filename):
+    if YAMLCache.default is None:
+        YAMLCache.default = YAMLCache()
+    return YAMLCache.default.load(filename)
@@ -0,0 +1,166 @@
+import collections
+import functools
+import logging
+import socket
+import threading
+import time
+
+import yaml
+
+from monitoring.cache import YAMLCache, load_yaml
+from monitoring.collector import Collector, HTTPClient, HTTPTransport
+from monitoring.collector import ResponseCache
+from monitoring.config import get_default_locator_config
+from monitoring.executor import Deadline, WorkerPool
+from monitoring.formatter import HumanOutputFormatter, SubagentOutputFormatter
+from monitoring.metrics import Metrics
+from monitoring.planner import QueryCoalescer, QueryPlanner
+from monitoring.schema import SchemaPool
+
+logger = logging.getLogger(__name__)
+
+
+class DNSCache(object):
+    """Resolved host addresses kept for ``ttl`` seconds.
+
+    Failed lookups are kept for ``negative_ttl`` seconds, so a host
+    removed from DNS is not looked up for every service it runs.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.addresses = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host):
+        now = time.time()
+        with self.lock:
+            entry = self.addresses.get(host)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        try:
+            address = socket.gethostbyname(host)
+            expires = now + self.ttl
+        except socket.error, e:
+            logger.warn('could not resolve %s: %s', host, e)
+            address = None
+            expires = now + self.negative_ttl
+        with self.lock:
+            self.addresses[host] = (expires, address)
+        return address
+
+
+class ClusterPoller(object):
+    """Collects http services of every host of a service map.
+
+    Services of the map are dotted name prefixes of locators, every
+    ``HttpServiceLocator`` of a matching locator is scraped on the host.
+    Process locators need local access to the JVM and are skipped.
+    At most ``per_host`` services of a host are collected at once.
+    Resolved addresses, schemas and http connections are kept between
+    collections, so a poller runs in a ``CollectorLoop``.
+    """
+
+    def __init__(self, service_map, locator_config=None, workers=64,
+                 per_host=2, dns=None, deadline=None, transport=None):
+        if transport is not None:
+            HTTPClient.transport = transport
+        if locator_config is None:
+            locator_config = get_default_locator_config()
+        self.service_map = service_map
+        self.locators = load_yaml(locator_config)
+        self.per_host = per_host
+        self.workers = workers
+        self.dns = dns or DNSCache()
+        self.deadline = deadline
+        self.schemas = SchemaPool()
+        self.pool = WorkerPool(workers, dict(
+            (host, per_host) for host in service_map))
+        self.formatters = {
+            'human': HumanOutputFormatter(),
+            'subagent': SubagentOutputFormatter(),
+        }
+
+    def get_targets(self):
+        """Sorted ``(host, schema name, port)`` of the service map."""
+        targets = set()
+        for host, services in self.service_map.items():
+            for service in services or []:
+                for name, locator in self.locators.items():
+                    if name != service and \
+                            not name.startswith(service + '.'):
+                        continue
+                    if locator.get('class') != 'HttpServiceLocator':
+                        logger.debug('skip %s on %s: %s', name, host,
+                                     locator.get('class'))
+                        continue
+                    targets.add((host, name, int(locator.get('port', 80))))
+        return sorted(targets)
+
+    def collect(self, oid, name, schema_dir=None):
+        """Collect all hosts, returns ``host => Metrics``."""
+        targets = self.get_targets()
+        snapshot = collections.OrderedDict(
+            (host, Metrics()) for host in sorted(set(x[0] for x in targets)))
+        cache = ResponseCache()
+        deadline = Deadline(self.deadline)
+        tasks = [((host, schema_name), host, functools.partial(
+                  self.collect_target, host, schema_name, port, oid, name,
+                  schema_dir, cache, deadline))
+                 for host, schema_name, port in targets]
+        for (host, schema_name), result in self.pool.run(
+                tasks, self.deadline):
+            if result is not None:
+                snapshot[host].update(result)
+        logger.info('collected %d services of %d hosts, response cache: %s',
+                    len(targets), len(snapshot), cache.stats())
+        return snapshot
+
+    def collect_target(self, host, schema_name, port, oid, name,
+                       schema_dir, cache, deadline):
+        address = self.dns.resolve(host)
+        if address is None:
+            return None
+        schema = self.schemas.acquire(schema_name, schema_dir)
+        if schema is None:
+            return None
+        try:
+            collector = Collector(
+                'http://%s:%d' % (address, port), schema, cache, deadline)
+            return collector.collect(oid, name)
+        finally:
+            self.schemas.release(schema_name, schema_dir, schema)
+
+    def output(self, snapshot, pattern=None, format=None):
+        """Formatted metrics of every host, lines prefixed by the host."""
+        if pattern is None:
+            pattern = '*'
+        lines = []
+        for host, metrics in snapshot.items():
+            output = self.formatters[format].output(metrics, pattern)
+            lines.extend('%s %s' % (host, x) for x in output.splitlines())
+        return '\n'.join(lines)
+
+
+def make_cluster_poller(service_map, config):
+    YAMLCache.default = YAMLCache(config.schemas.cache_dir)
+    if config.http.projection:
+        Collector.planner = QueryPlanner()
+    if config.http.coalesce:
+        Collector.coalescer = QueryCoalescer(config.http.round_trip_cost)
+    with open(service_map) as h:
+        services = yaml.load(h.read()) or {}
+    return ClusterPoller(
+        services,
+        locator_config=config.locator.filename,
+        workers=config.cluster.workers,
+        per_host=config.cluster.per_host,
+        dns=DNSCache(config.cluster.dns_ttl),
+        deadline=config.collector.deadline,
+        transport=HTTPTransport(
+            pool_size=config.http.pool_size,
+            keepalive=config.http.keepalive,
+            connect_timeout=config.http.connect_timeout,
+            read_timeout=config.http.read_timeout,
+            streaming=config.http.streaming))
@@ -1,8 +1,17 @@
+import atexit
+import errno
 import json
 import logging
 import os
 import re
+import select
+import socket
 import subprocess
+import threading
+import time
+
+from monitoring import extractor
+from monitoring.executor import Deadline, TIMED_OUT
 
 logger = logging.getLogger(__name__)
 
@@ -11,43 +20,384 @@ class Client(object):
     def __init__(self, endpoint):
         raise NotImplementedError('init requeires one argument - endpoint')
 
-    def make_request(self, query):
+    def make_request(self, query, paths=None):
         raise NotImplementedError('abstract method is called')
 
+    def make_batch_request(self, queries, paths=None):
+        paths = paths or [None] * len(queries)
+        return [self.make_request(query, query_paths)
+                for query, query_paths in zip(queries, paths)]
+
+    def is_streamed(self, paths):
+        """Whether a response is reduced to ``paths`` while it is read."""
+        return False
+
+
+class HTTPTransport(object):
+    """Keep-alive connection pools, one requests session per endpoint."""
+
+    def __init__(self, pool_size=4, keepalive=True,
+                 connect_timeout=3.0, read_timeout=10.0, streaming=False):
+        self.pool_size = int(pool_size)
+        self.keepalive = keepalive
+        self.streaming = streaming
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.sessions = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def get(self, endpoint, path, headers=None, stream=False, timeout=None):
+        session = self.get_session(endpoint)
+        headers = dict(headers or {})
+        if not self.keepalive:
+            headers['connection'] = 'close'
+        with self.lock:
+            self.requests += 1
+        if timeout is None:
+            timeout = self.timeout
+        else:
+            timeout = tuple(min(x, timeout) for x in self.timeout)
+        kwargs = {'headers': headers, 'timeout': timeout}
+        if stream:
+            kwargs['stream'] = True
+        return session.get('%s%s' % (endpoint, path), **kwargs)
+
+    def get_session(self, endpoint):
+        with self.lock:
+            if endpoint not in self.sessions:
+                self.sessions[endpoint] = self.create_session()
+            return self.sessions[endpoint]
+
+    def create_session(self):
+        import requests
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def stats(self):
+        connections = 0
+        with self.lock:
+            for session in self.sessions.values():
+                for adapter in set(session.adapters.values()):
+                    poolmanager = getattr(adapter, 'poolmanager', None)
+                    if poolmanager is None:
+                        continue
+                    for key in poolmanager.pools.keys():
+                        pool = poolmanager.pools.get(key)
+                        connections += getattr(pool, 'num_connections', 0)
+            return {
+                'requests': self.requests,
+                'connections': connections,
+                'reused': max(self.requests - connections, 0),
+            }
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
 
 class HTTPClient(Client):
-    def __init__(self, endpoint):
+    transport = None
+
+    def __init__(self, endpoint, deadline=None):
         self.endpoint = endpoint.rstrip('/')
+        self.deadline = deadline or Deadline()
 
-    def make_request(self, query):
-        import requests
+    def get_transport(self):
+        if HTTPClient.transport is None:
+            HTTPClient.transport = HTTPTransport()
+        return HTTPClient.transport
 
-        url = '%s%s' % (self.endpoint, query)
+    def is_streamed(self, paths):
+        return bool(paths) and self.get_transport().streaming and \
+            extractor.is_available()
+
+    def make_request(self, query, paths=None):
         headers = {'accept': 'application/json'}
-        logger.debug('request to %s', url)
+        logger.debug('request to %s%s', self.endpoint, query)
+        transport = self.get_transport()
+        stream = self.is_streamed(paths)
+        if self.deadline.expired():
+            logger.warn('deadline exceeded, skip %s%s', self.endpoint, query)
+            return TIMED_OUT
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            return json.loads(response.text)
-        except Exception:
+            response = transport.get(self.endpoint, query, headers, stream,
+                                     self.deadline.remaining())
+            try:
+                response.raise_for_status()
+                if stream:
+                    response.raw.decode_content = True
+                    return extractor.extract(response.raw, paths)
+                return json.loads(response.text)
+            finally:
+                if stream:
+                    response.close()
+        except Exception, e:
+            if self.is_timeout(e):
+                logger.error('request to %s%s timed out', self.endpoint, query)
+                return TIMED_OUT
             logger.exception('could not retrieve data')
             return None
 
+    def is_timeout(self, error):
+        import requests
+
+        return isinstance(error, (requests.exceptions.Timeout,
+                                  socket.timeout)) or self.deadline.expired()
+
+
+class JMXSession(object):
+    """Long-living jmxterm process attached to one JVM.
+
+    Commands are written to jmxterm's stdin, each batch is followed by
+    a query of an attribute every MBean server has, its value marks the
+    end of the batch output.
+    """
+    executable = '/usr/bin/jmxterm'
+    separator = ('get -b JMImplementation:type=MBeanServerDelegate '
+                 '-s -q SpecificationName\n')
+    separator_value = 'Java Management Extensions'
+
+    def __init__(self, user, pid, timeout=30):
+        self.user = user
+        self.pid = pid
+        self.timeout = timeout
+        self.proc = None
+        self.buffer = ''
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+
+    def get_command(self):
+        return 'sudo -u %s %s -l %s -n -v silent' % (
+            self.user, self.executable, self.pid)
+
+    def start(self):
+        logger.info('starting jmxterm session %s@%d', self.user, self.pid)
+        with open(os.devnull, 'w') as devnull:
+            self.proc = subprocess.Popen(
+                self.get_command(), shell=True,
+                stdin=subprocess.PIPE,
+                stderr=devnull,
+                stdout=subprocess.PIPE)
+        self.buffer = ''
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def check(self):
+        return self.execute('') is not None
+
+    def execute(self, data, timeout=None, count=1):
+        """Output of ``count`` separated commands of ``data``.
+
+        Outputs of the commands keep their separator lines, so the
+        session stays in sync with jmxterm whatever the batch size.
+        """
+        with self.lock:
+            self.last_used = time.time()
+            try:
+                if not self.is_alive():
+                    self.start()
+                self.proc.stdin.write(data + self.separator)
+                self.proc.stdin.flush()
+                output = self.read(timeout, count)
+            except (IOError, OSError), e:
+                logger.error('jmxterm session %s@%d: %s',
+                             self.user, self.pid, e)
+                output = None
+            if output is None:
+                self.stop()
+            return output
+
+    def read(self, timeout=None, count=1):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        fd = self.proc.stdout.fileno()
+        while True:
+            lines = self.buffer.split('\n')
+            separators = 0
+            for number, line in enumerate(lines[:-1]):
+                if line.strip() != self.separator_value:
+                    continue
+                separators += 1
+                if separators == count:
+                    self.buffer = '\n'.join(lines[number + 1:])
+                    return '\n'.join(lines[:number] + [''])
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.error('jmxterm session %s@%d: timeout',
+                             self.user, self.pid)
+                return None
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                logger.error('jmxterm session %s@%d: exited',
+                             self.user, self.pid)
+                return None
+            self.buffer += chunk
+
+    def stop(self):
+        if self.proc is None:
+            return
+        logger.info('stopping jmxterm session %s@%d', self.user, self.pid)
+        try:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
+        except OSError, e:
+            logger.debug('jmxterm session %s@%d: %s', self.user, self.pid, e)
+        self.proc = None
+
+
+class JMXSessionPool(object):
+    """Jmxterm sessions keyed by (user, pid).
+
+    Sessions of exited JVMs and sessions not used for ``idle_timeout``
+    seconds are stopped, so a restarted service gets a fresh session.
+    A running session not used for ``check_interval`` seconds is checked
+    before it is handed out, a session failing the check is stopped and
+    started again by its next request.
+    """
+
+    def __init__(self, idle_timeout=300, timeout=30, check_interval=60):
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.sessions = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def get(self, user, pid):
+        now = time.time()
+        with self.lock:
+            self.evict()
+            session = self.sessions.get((user, pid))
+            if session is None:
+                session = JMXSession(user, pid, self.timeout)
+                self.sessions[(user, pid)] = session
+            idle = now - session.last_used
+            session.last_used = now
+        if idle > self.check_interval and session.is_alive():
+            self.check_session((user, pid), session)
+        return session
+
+    def evict(self):
+        now = time.time()
+        for key, session in self.sessions.items():
+            if now - session.last_used > self.idle_timeout or \
+                    not self.pid_exists(session.pid):
+                session.stop()
+                del self.sessions[key]
+
+    def check(self):
+        """Check all running sessions, unhealthy ones are stopped."""
+        with self.lock:
+            sessions = self.sessions.items()
+        for key, session in sessions:
+            if session.is_alive():
+                self.check_session(key, session)
+
+    def check_session(self, key, session):
+        if session.check():
+            return True
+        logger.warn('jmxterm session %s@%d is unhealthy', *key)
+        session.stop()
+        return False
+
+    def reset(self, user, pid):
+        """Stop the session of (user, pid), it is out of sync."""
+        with self.lock:
+            session = self.sessions.pop((user, pid), None)
+        if session is not None:
+            session.stop()
+
+    def pid_exists(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno == errno.EPERM
+        return True
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.stop()
+            self.sessions = {}
+
 
 class JMXClient(Client):
-    def __init__(self, endpoint):
+    sessions = None
+
+    def __init__(self, endpoint, deadline=None):
+        self.endpoint = endpoint
         self.user = endpoint.split('@')[0].split('://')[-1]
         self.pid = int(endpoint.split('@')[-1])
+        self.deadline = deadline or Deadline()
 
-    def make_request(self, query):
+    def make_request(self, query, paths=None):
         input_data = self.create_input(query)
         logger.debug('request to %s@%d:\n%s', self.user, self.pid, input_data)
-        command = self.get_command()
-        output = self.run_command(command, input_data)
-        if output is None:
-            return None
+        output = self.execute(input_data)
+        if output is None or output is TIMED_OUT:
+            return output
         return self.parse_output(output)
 
+    def make_batch_request(self, queries, paths=None):
+        if len(queries) < 2:
+            return [self.make_request(query) for query in queries]
+        input_data = JMXSession.separator.join(
+            [self.create_input(query) for query in queries])
+        logger.debug('batch request to %s@%d:\n%s',
+                     self.user, self.pid, input_data)
+        output = self.execute(input_data, len(queries))
+        if output is TIMED_OUT:
+            return [TIMED_OUT] * len(queries)
+        outputs = self.split_output(output)
+        if len(outputs) != len(queries):
+            logger.warn('batch request to %s@%d failed, '
+                        'run queries one by one', self.user, self.pid)
+            if JMXClient.sessions is not None:
+                JMXClient.sessions.reset(self.user, self.pid)
+            return [self.make_request(query) for query in queries]
+        return [self.parse_output(x) for x in outputs]
+
+    def split_output(self, output):
+        if output is None:
+            return []
+        outputs = [[]]
+        for line in output.split('\n'):
+            if line.strip() == JMXSession.separator_value:
+                outputs.append([])
+            else:
+                outputs[-1].append(line)
+        return ['\n'.join(x) for x in outputs]
+
+    def execute(self, input_data, count=1):
+        if self.deadline.expired():
+            logger.warn('deadline exceeded, skip request to %s@%d',
+                        self.user, self.pid)
+            return TIMED_OUT
+        if JMXClient.sessions is not None:
+            session = JMXClient.sessions.get(self.user, self.pid)
+            output = session.execute(
+                input_data, self.deadline.budget(session.timeout), count)
+            if output is not None:
+                return output
+            if self.deadline.expired():
+                return TIMED_OUT
+            logger.warn('jmxterm session %s@%d failed, run single command',
+                        self.user, self.pid)
+        return self.run_command(self.get_command(), input_data)
+
     def parse_output(self, output):
         pattern = re.compile(r'"(.*?)"\s*=\s*(.*?);', re.S | re.U)
         data = pattern.findall(output)
@@ -60,8 +410,20 @@ class JMXClient(Client):
             stdin=subprocess.PIPE,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE)
-        proc.stdin.write(data)
-        out, err = proc.communicate()
+        timer = None
+        if self.deadline.remaining() is not None:
+            timer = threading.Timer(
+                self.deadline.remaining(), self.terminate, [proc])
+            timer.start()
+        try:
+            proc.stdin.write(data)
+            out, err = proc.communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if proc.returncode != 0 and self.deadline.expired():
+            logger.error('command timed out: %s', command)
+            return TIMED_OUT
         if proc.returncode != 0:
             logger.error('command: %s', command)
             logger.error('return code: %d', proc.returncode)
@@ -70,6 +432,12 @@ class JMXClient(Client):
             return None
         return out
 
+    def terminate(self, proc):
+        try:
+            proc.terminate()
+        except OSError, e:
+            logger.debug('could not terminate %s: %s', proc.pid, e)
+
     def get_command(self):
         executable = '/usr/bin/jmxterm'
         return 'sudo -u %s %s -l %s' % (self.user, executable, self.pid)
@@ -83,22 +451,192 @@ class JMXClient(Client):
             raise KeyError('invalid query: %s', e.message)
 
 
+class CacheEntry(object):
+    def __init__(self):
+        self.value = None
+        self.ready = threading.Event()
+
+    def set(self, value):
+        self.value = value
+        self.ready.set()
+
+    def wait(self):
+        self.ready.wait()
+        return self.value
+
+
+class ResponseCache(object):
+    """Responses of one collection pass keyed by (endpoint, query).
+
+    The first caller of a key fetches the response, concurrent callers
+    of the same key wait for it.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_key(self, endpoint, query, paths=None):
+        return endpoint, json.dumps([query, paths], sort_keys=True)
+
+    def reserve(self, endpoint, query, paths=None):
+        key = self.get_key(endpoint, query, paths)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry, False
+            self.misses += 1
+            entry = self.entries[key] = CacheEntry()
+            return entry, True
+
+    def get(self, endpoint, query, fetch):
+        entry, owner = self.reserve(endpoint, query)
+        if owner:
+            self.fill([entry], lambda: [fetch()])
+        return entry.wait()
+
+    def fill(self, entries, fetch):
+        values = []
+        try:
+            values = fetch()
+        finally:
+            values = list(values) + [None] * (len(entries) - len(values))
+            for entry, value in zip(entries, values):
+                entry.set(value)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
 class Collector(object):
     clients = {
         'http': HTTPClient,
         'process': JMXClient,
     }
+    planner = None
+    coalescer = None
 
-    def __init__(self, endpoint, schema):
+    def __init__(self, endpoint, schema, cache=None, deadline=None):
         self.endpoint = endpoint
         self.schema = schema
+        self.cache = cache
+        self.deadline = deadline
         self.schema.set_request_executor(self.make_request)
+        self.schema.set_batch_executor(self.make_batch_request)
 
     def make_request(self, query, endpoint=None):
+        client = self.get_client(endpoint)
+        if self.cache is None:
+            return client.make_request(query)
+        return self.cache.get(
+            client.endpoint, query, lambda: client.make_request(query))
+
+    def make_batch_request(self, requests):
+        results = [None] * len(requests)
+        batches = {}
+        for number, request in enumerate(requests):
+            endpoint = request.get('endpoint') or self.endpoint
+            batches.setdefault(endpoint, []).append(number)
+        for endpoint, numbers in batches.items():
+            queries = [requests[x]['query'] for x in numbers]
+            paths = [self.schema.get_request_paths(requests[x])
+                     for x in numbers]
+            planned = self.plan_queries(
+                endpoint, queries, [requests[x] for x in numbers])
+            responses = self.make_coalesced_request(endpoint, planned, paths)
+            responses = self.check_planned_responses(
+                endpoint, queries, planned, paths, responses)
+            for number, response in zip(numbers, responses):
+                results[number] = response
+        return results
+
+    def plan_queries(self, endpoint, queries, requests):
+        if self.planner is None:
+            return queries
+        return [self.planner.plan(endpoint, query,
+                                  self.schema.get_request_addresses(request))
+                for query, request in zip(queries, requests)]
+
+    def check_planned_responses(self, endpoint, queries, planned, paths,
+                                responses):
+        failed = []
+        for number, query in enumerate(queries):
+            # a failed request says nothing about the rewrite, keep it
+            if planned[number] == query or responses[number] is None or \
+                    responses[number] is TIMED_OUT:
+                continue
+            if not self.planner.is_accepted(
+                    planned[number], responses[number]):
+                self.planner.reject(endpoint, planned[number])
+                failed.append(number)
+        if not failed:
+            return responses
+
+        responses = list(responses)
+        retried = self.make_client_batch_request(
+            endpoint, [queries[x] for x in failed], [paths[x] for x in failed])
+        for number, response in zip(failed, retried):
+            responses[number] = response
+        return responses
+
+    def make_coalesced_request(self, endpoint, queries, paths):
+        if self.coalescer is None or self.get_uri_schema(endpoint) != 'http':
+            return self.make_client_batch_request(endpoint, queries, paths)
+
+        groups = self.coalescer.coalesce(endpoint, queries)
+        fetched = self.make_client_batch_request(
+            endpoint, [x[0] for x in groups],
+            [self.merge_paths([paths[n] for n in x[1]]) for x in groups])
+        results = [None] * len(queries)
+        for (query, numbers), response in zip(groups, fetched):
+            self.coalescer.record(endpoint, query, response)
+            if len(numbers) == 1 and queries[numbers[0]] == query:
+                results[numbers[0]] = response
+                continue
+            originals = [queries[x] for x in numbers]
+            parts = self.coalescer.split(originals, response)
+            for number, original, part in zip(numbers, originals, parts):
+                self.coalescer.record(endpoint, original, part)
+                results[number] = part
+        return results
+
+    def merge_paths(self, paths):
+        if len(paths) == 1:
+            return paths[0]
+        if any(x is None for x in paths):
+            return None
+        return extractor.minimize_paths(sum(paths, []))
+
+    def make_client_batch_request(self, endpoint, queries, paths):
+        client = self.get_client(endpoint)
+        if self.cache is None:
+            return client.make_batch_request(queries, paths)
+
+        entries = []
+        fetch = []
+        for query, query_paths in zip(queries, paths):
+            # only a streamed response depends on the leaves it is read for
+            entry, owner = self.cache.reserve(
+                client.endpoint, query,
+                query_paths if client.is_streamed(query_paths) else None)
+            entries.append(entry)
+            if owner:
+                fetch.append((entry, query, query_paths))
+        if fetch:
+            self.cache.fill(
+                [x[0] for x in fetch],
+                lambda: client.make_batch_request(
+                    [x[1] for x in fetch], [x[2] for x in fetch]))
+        return [entry.wait() for entry in entries]
+
+    def get_client(self, endpoint=None):
         endpoint = endpoint or self.endpoint
         uri_schema = self.get_uri_schema(endpoint)
-        client = Collector.clients[uri_schema](endpoint)
-        return client.make_request(query)
+        return Collector.clients[uri_schema](endpoint, self.deadline)
 
     def get_uri_schema(self, endpoint):
         return endpoint.split('://')[0]
@@ -4,25 +4,79 @@ from collections import namedtuple
 
 
 def make_config(data):
-    base = namedtuple('Base', ('oid', 'name'))
+    base = namedtuple('Base', ('oid', 'name', 'numeric_oid'))
     logging = namedtuple('Logging', ('filename', 'level'))
     locator = namedtuple(
-        'Locator', ('filename', 'service_map'))
-    schemas = namedtuple('Schemas', ('directory',))
-    config = namedtuple('Config', ('base', 'logging', 'locator', 'schemas'))
+        'Locator', ('filename', 'service_map', 'discovery_timeout',
+                    'cache_ttl'))
+    schemas = namedtuple('Schemas', ('directory', 'cache_dir'))
+    collector = namedtuple(
+        'Collector', ('workers', 'http_workers', 'process_workers',
+                      'deadline', 'rates'))
+    http = namedtuple(
+        'Http', ('pool_size', 'keepalive', 'connect_timeout', 'read_timeout',
+                 'streaming', 'projection', 'coalesce', 'round_trip_cost'))
+    jmx = namedtuple(
+        'Jmx', ('sessions', 'idle_timeout', 'timeout', 'check_interval'))
+    daemon = namedtuple(
+        'Daemon', ('socket', 'interval', 'http_host', 'http_port',
+                   'snapshot_file'))
+    cluster = namedtuple(
+        'Cluster', ('workers', 'per_host', 'dns_ttl', 'interval'))
+    config = namedtuple(
+        'Config',
+        ('base', 'logging', 'locator', 'schemas', 'collector', 'http', 'jmx',
+         'daemon', 'cluster'))
 
     base = base(data.get('base', {}).get('oid', 'hadoop'),
-                data.get('base', {}).get('name', 'hadoop'))
+                data.get('base', {}).get('name', 'hadoop'),
+                data.get('base', {}).get('numeric_oid'))
     logging = logging(
         data.get('logging', {}).get('filename'),
         data.get('logging', {}).get('level', 'INFO'))
     locator = locator(
         data.get('locator', {}).get('filename', get_default_locator_config()),
-        data.get('locator', {}).get('service_map'))
+        data.get('locator', {}).get('service_map'),
+        data.get('locator', {}).get('discovery_timeout', 5),
+        data.get('locator', {}).get('cache_ttl', 300))
     schemas = schemas(
-        data.get('schemas', {}).get('directory', get_default_schemas_dir()))
-
-    return config(base, logging, locator, schemas)
+        data.get('schemas', {}).get('directory', get_default_schemas_dir()),
+        data.get('schemas', {}).get('cache_dir', get_default_cache_dir()))
+    collector = collector(
+        data.get('collector', {}).get('workers', 8),
+        data.get('collector', {}).get('http_workers', 8),
+        data.get('collector', {}).get('process_workers', 2),
+        data.get('collector', {}).get('deadline'),
+        data.get('collector', {}).get('rates', False))
+    http = http(
+        data.get('http', {}).get('pool_size', 4),
+        data.get('http', {}).get('keepalive', True),
+        data.get('http', {}).get('connect_timeout', 3),
+        data.get('http', {}).get('read_timeout', 10),
+        data.get('http', {}).get('streaming', False),
+        data.get('http', {}).get('projection', True),
+        data.get('http', {}).get('coalesce', False),
+        data.get('http', {}).get('round_trip_cost', 4096))
+    jmx = jmx(
+        data.get('jmx', {}).get('sessions', False),
+        data.get('jmx', {}).get('idle_timeout', 300),
+        data.get('jmx', {}).get('timeout', 30),
+        data.get('jmx', {}).get('check_interval', 60))
+    daemon = daemon(
+        data.get('daemon', {}).get('socket', get_default_socket()),
+        data.get('daemon', {}).get('interval', 60),
+        data.get('daemon', {}).get('http_host', ''),
+        data.get('daemon', {}).get('http_port'),
+        data.get('daemon', {}).get('snapshot_file'))
+    cluster = cluster(
+        data.get('cluster', {}).get('workers', 64),
+        data.get('cluster', {}).get('per_host', 2),
+        data.get('cluster', {}).get('dns_ttl', 300),
+        data.get('cluster', {}).get('interval', 0))
+
+    return config(
+        base, logging, locator, schemas, collector, http, jmx, daemon,
+        cluster)
 
 
 def load_config(filename):
@@ -61,6 +115,15 @@ def get_default_templates_dir():
         os.path.dirname(__file__), 'data', 'subagent')
 
 
+def get_default_cache_dir():
+    return os.path.join(
+        os.path.expanduser('~'), '.cache', 'hadoop-monitoring')
+
+
+def get_default_socket():
+    return '/var/run/hadoop-monitoring.sock'
+
+
 def find_config():
     for varaint in get_config_variants():
         if os.path.isfile(varaint):
@@ -0,0 +1,239 @@
+import BaseHTTPServer
+import logging
+import os
+import socket
+import SocketServer
+import threading
+import time
+import zlib
+
+from monitoring.snapshot import SnapshotFileWriter
+
+logger = logging.getLogger(__name__)
+
+# keep in sync with monitoring.config.get_default_socket,
+# the client does not import config to start faster
+DEFAULT_SOCKET = '/var/run/hadoop-monitoring.sock'
+
+
+class SnapshotStore(object):
+    """Latest collected metrics and their formatted outputs.
+
+    Outputs are rendered once per snapshot, compressed outputs are
+    kept next to them.
+    """
+
+    def __init__(self, formatter):
+        self.formatter = formatter
+        self.metrics = None
+        self.timestamp = None
+        self.outputs = {}
+        self.compressed = {}
+        self.lock = threading.Lock()
+
+    def update(self, metrics):
+        with self.lock:
+            self.metrics = metrics
+            self.timestamp = time.time()
+            self.outputs = {}
+            self.compressed = {}
+
+    def output(self, format, pattern=None):
+        with self.lock:
+            if self.metrics is None:
+                return None
+            key = (format, pattern)
+            if key not in self.outputs:
+                self.outputs[key] = self.formatter(
+                    self.metrics, pattern, format)
+            return self.outputs[key]
+
+    def output_gzip(self, format, pattern=None):
+        output = self.output(format, pattern)
+        if output is None:
+            return None
+        with self.lock:
+            key = (format, pattern)
+            if key not in self.compressed:
+                if isinstance(output, unicode):
+                    output = output.encode('utf-8')
+                compressor = zlib.compressobj(
+                    6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                self.compressed[key] = \
+                    compressor.compress(output) + compressor.flush()
+            return self.compressed[key]
+
+
+class SnapshotRequestHandler(SocketServer.StreamRequestHandler):
+    formats = ('human', 'subagent')
+
+    def handle(self):
+        request = self.rfile.readline().strip().split(None, 1)
+        if not request or request[0] not in self.formats:
+            logger.warn('invalid request: %r', request)
+            return
+        format = request[0]
+        pattern = request[1] if len(request) > 1 else None
+        output = self.server.store.output(format, pattern)
+        if output is None:
+            logger.warn('no snapshot collected yet')
+            return
+        self.wfile.write(output)
+
+
+class SnapshotServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, store):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.UnixStreamServer.__init__(
+            self, path, SnapshotRequestHandler)
+        self.store = store
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class ExpositionRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the snapshot in Prometheus text format on ``/metrics``."""
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        accepted = self.headers.get('Accept-Encoding', '')
+        compressed = 'gzip' in [x.split(';')[0].strip()
+                                for x in accepted.split(',')]
+        if compressed:
+            output = self.server.store.output_gzip('prometheus')
+        else:
+            output = self.server.store.output('prometheus')
+            if isinstance(output, unicode):
+                output = output.encode('utf-8')
+        if output is None:
+            self.send_error(503, 'no snapshot collected yet')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', self.content_type)
+        self.send_header('Content-Length', str(len(output)))
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(output)
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+class ExpositionServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, store):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, address, ExpositionRequestHandler)
+        self.store = store
+
+
+class CollectorLoop(object):
+    """Collects metrics every ``interval`` seconds and passes them to
+    listeners."""
+
+    def __init__(self, service, oid, name, interval=60, service_map=None):
+        self.service = service
+        self.oid = oid
+        self.name = name
+        self.interval = interval
+        self.service_map = service_map
+        self.listeners = []
+        self.stopped = threading.Event()
+
+    def collect(self):
+        started = time.time()
+        metrics = self.service.collect(self.oid, self.name)
+        if self.service_map is not None:
+            self.service.check_services(metrics, self.service_map, self.name)
+        for listener in self.listeners:
+            listener(metrics)
+        logger.info('collected %d metrics in %.3fs',
+                    len(metrics), time.time() - started)
+
+    def collect_forever(self):
+        while not self.stopped.is_set():
+            started = time.time()
+            try:
+                self.collect()
+            except Exception:
+                logger.exception('collection failed')
+            self.stopped.wait(max(self.interval - (time.time() - started), 0))
+
+    def start(self):
+        thread = threading.Thread(target=self.collect_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+
+class CollectorDaemon(object):
+    """Serves the latest snapshot of a collector loop over a unix socket
+    and, if ``http_address`` is set, over http for Prometheus. Snapshots
+    are also published to ``snapshot_file`` if it is set."""
+
+    def __init__(self, loop, socket_path=DEFAULT_SOCKET, http_address=None,
+                 snapshot_file=None):
+        self.loop = loop
+        self.store = SnapshotStore(loop.service.output)
+        self.loop.listeners.append(self.store.update)
+        if snapshot_file is not None:
+            self.loop.listeners.append(
+                SnapshotFileWriter(snapshot_file).update)
+        self.server = SnapshotServer(socket_path, self.store)
+        self.exposition = None
+        if http_address is not None:
+            self.exposition = ExpositionServer(http_address, self.store)
+
+    def run(self):
+        self.loop.start()
+        if self.exposition is not None:
+            thread = threading.Thread(target=self.exposition.serve_forever)
+            thread.daemon = True
+            thread.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if self.exposition is not None:
+                self.exposition.server_close()
+
+    def stop(self):
+        self.loop.stop()
+        threading.Thread(target=self.server.shutdown).start()
+        if self.exposition is not None:
+            threading.Thread(target=self.exposition.shutdown).start()
+
+
+def request_snapshot(path=DEFAULT_SOCKET, format='subagent', pattern=None,
+                     timeout=5):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        request = format if pattern is None else '%s %s' % (format, pattern)
+        client.sendall(request + '\n')
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return ''.join(chunks)
+    finally:
+        client.close()
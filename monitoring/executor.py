@@ -0,0 +1,189 @@
+import collections
+import logging
+import Queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TimedOut(object):
+    """Response of a request not finished before the deadline."""
+
+    def __repr__(self):
+        return 'TIMED_OUT'
+
+    def __nonzero__(self):
+        return False
+
+
+TIMED_OUT = TimedOut()
+
+
+class Deadline(object):
+    """Time budget of one collection pass.
+
+    Requests get the time left till ``timeout - grace`` seconds, so the
+    ones cut by the deadline are reported before the pass is abandoned.
+    """
+
+    def __init__(self, timeout=None, grace=0.5):
+        self.timeout = timeout
+        self.expires = None
+        if timeout is not None:
+            self.expires = time.time() + max(timeout - grace, 0)
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(self.expires - time.time(), 0)
+
+    def expired(self):
+        return self.remaining() == 0
+
+    def budget(self, timeout):
+        """Timeout of a request, ``timeout`` limited by the time left."""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+class WorkerPool(object):
+    """Bounded pool of worker threads.
+
+    Tasks are ``(key, group, func)`` tuples. ``func`` is called without
+    arguments, ``group`` selects a concurrency limit from ``limits``
+    (tasks of unknown groups are limited by the pool size only).
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, size=4, limits=None):
+        self.size = max(int(size), 1)
+        self.limits = {}
+        for group, limit in (limits or {}).items():
+            self.limits[group] = threading.BoundedSemaphore(max(int(limit), 1))
+
+    def run(self, tasks, timeout=None):
+        """Run tasks and yield ``(key, result)`` pairs as they finish.
+
+        Tasks are consumed lazily, so a generator of tasks is started
+        as soon as it yields. Failed tasks are logged and skipped.
+        If ``timeout`` is set, tasks not finished in ``timeout`` seconds
+        are abandoned. A task is queued only when its group has a free
+        slot, tasks of busy groups wait aside so workers are not blocked
+        while tasks of other groups are ready.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        pending = Queue.Queue()
+        results = Queue.Queue()
+        cancelled = threading.Event()
+        workers = []
+        for _ in range(self.size):
+            worker = threading.Thread(
+                target=self.worker, args=(pending, results, cancelled))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        running = {}
+        waiting = {}
+        try:
+            for task in tasks:
+                running[task[0]] = task[1]
+                waiting.setdefault(task[1], collections.deque()).append(task)
+                self.dispatch(waiting, task[1], pending)
+                for key, ok, result in self.drain(results):
+                    self.dispatch(waiting, running.pop(key), pending)
+                    if ok:
+                        yield key, result
+                if self.remaining(deadline) == 0:
+                    break
+
+            while running:
+                remaining = self.remaining(deadline)
+                if any(waiting.values()):
+                    # a slot may be released by another run of the pool
+                    remaining = min(remaining, self.poll_interval) \
+                        if remaining is not None else self.poll_interval
+                try:
+                    key, ok, result = results.get(timeout=remaining)
+                except Queue.Empty:
+                    if self.remaining(deadline) == 0:
+                        break
+                    for group in waiting.keys():
+                        self.dispatch(waiting, group, pending)
+                    continue
+                self.dispatch(waiting, running.pop(key), pending)
+                if ok:
+                    yield key, result
+            if running:
+                logger.warn('abandoned after %.1fs: %s',
+                            timeout, ', '.join(map(str, sorted(running))))
+        finally:
+            cancelled.set()
+            self.cancel(pending)
+            for _ in workers:
+                pending.put(None)
+            if not running:
+                # idle workers exit on the sentinel, wait for them so
+                # none is left running at interpreter shutdown
+                for worker in workers:
+                    worker.join()
+
+    def dispatch(self, waiting, group, pending):
+        """Queue waiting tasks of ``group`` while it has free slots."""
+        tasks = waiting.get(group)
+        limit = self.limits.get(group)
+        while tasks:
+            if limit is not None and not limit.acquire(False):
+                return
+            pending.put(tasks.popleft())
+
+    def cancel(self, pending):
+        """Release slots of queued tasks no worker is going to run."""
+        for task in self.drain(pending):
+            if task is not None:
+                self.release(task[1])
+
+    def remaining(self, deadline):
+        if deadline is None:
+            return None
+        return max(deadline - time.time(), 0)
+
+    def drain(self, results):
+        while True:
+            try:
+                yield results.get_nowait()
+            except Queue.Empty:
+                return
+
+    def worker(self, pending, results, cancelled):
+        while True:
+            task = pending.get()
+            if task is None:
+                return
+            if cancelled.is_set():
+                self.release(task[1])
+                return
+            results.put(self.execute(*task))
+
+    def execute(self, key, group, func):
+        """Run a task, the slot of its group is taken by ``dispatch``."""
+        try:
+            return key, True, func()
+        except Exception:
+            logger.exception('task %s failed', key)
+            return key, False, None
+        finally:
+            self.release(group)
+
+    def release(self, group):
+        limit = self.limits.get(group)
+        if limit is not None:
+            limit.release()
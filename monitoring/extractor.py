@@ -0,0 +1,101 @@
+import decimal
+import logging
+
+logger = logging.getLogger(__name__)
+
+START_EVENTS = ('start_map', 'start_array')
+END_EVENTS = ('end_map', 'end_array')
+
+
+AVAILABLE = None
+
+
+def is_available():
+    global AVAILABLE
+    if AVAILABLE is None:
+        try:
+            import ijson
+            AVAILABLE = True
+        except ImportError:
+            logger.warn('ijson is not installed, streaming is disabled')
+            AVAILABLE = False
+    return AVAILABLE
+
+
+def minimize_paths(paths):
+    """Drop paths nested in other paths, None means the whole document."""
+    if paths is None:
+        return None
+    result = []
+    for path in sorted(set(paths)):
+        if not result or path[:len(result[-1])] != result[-1]:
+            result.append(path)
+    return result
+
+
+def store(document, path, value):
+    for key in path[:-1]:
+        document = document.setdefault(key, {})
+    document[path[-1]] = value
+
+
+def extract(stream, paths):
+    """Parse JSON from ``stream`` keeping only subtrees at ``paths``.
+
+    ``paths`` are tuples of object keys from the root of the document.
+    The result has the same shape as the full document, but contains only
+    the requested subtrees. Parsing stops as soon as all of them are read.
+    """
+    import ijson
+    from ijson.common import ObjectBuilder
+
+    required = set(paths)
+    result = {}
+    position = []
+    builder = None
+    target = None
+    depth = 0
+    for _, event, value in ijson.parse(stream):
+        if isinstance(value, decimal.Decimal):
+            value = float(value)
+
+        if builder is not None:
+            builder.event(event, value)
+            if event in START_EVENTS:
+                depth += 1
+            elif event in END_EVENTS:
+                depth -= 1
+            if depth == 0:
+                store(result, target, builder.value)
+                required.discard(target)
+                builder = None
+                if not required:
+                    break
+            continue
+
+        if event == 'map_key':
+            position[-1] = value
+            continue
+        if event in END_EVENTS:
+            position.pop()
+            continue
+
+        current = tuple(position)
+        if current in required:
+            if event in START_EVENTS:
+                builder = ObjectBuilder()
+                builder.event(event, value)
+                target = current
+                depth = 1
+            else:
+                store(result, current, value)
+                required.discard(current)
+                if not required:
+                    break
+            continue
+
+        if event in START_EVENTS:
+            position.append(None)
+    if required:
+        logger.debug('not found in response: %s', sorted(required))
+    return result
@@ -1,13 +1,16 @@
 import collections
-import copy
-import fnmatch
+import functools
 import glob
+import json
 import logging
 import os
-import shutil
+import re
+import time
 
 import jinja2
 
+from monitoring.cache import write_atomic
+from monitoring.executor import WorkerPool
 from monitoring.utils import human_size_format
 from monitoring.utils import get_snmp_name
 
@@ -20,80 +23,254 @@ class HumanOutputFormatter:
 
     def output(self, metrics, pattern):
         lines = []
-        keys = fnmatch.filter(metrics.keys(), pattern)
-        if not keys:
+        numbers = sorted(metrics.get_index().glob(pattern),
+                         key=lambda x: metrics.metas[x].name)
+        if not numbers:
             return ""
-        self.max_key_length = max(map(lambda x: len(x), keys))
-        for key in sorted(keys):
-            record = metrics[key]
-            if record.get("value") is None:
+        self.max_key_length = max(len(metrics.metas[x].name) for x in numbers)
+        for number in numbers:
+            meta = metrics.metas[number]
+            if number in metrics.timeouts:
+                lines.append(self.format_timeout(meta.name))
                 continue
-            lines.append(self.format(key, record))
+            value = metrics.values[number]
+            if value is None:
+                continue
+            lines.append(self.format(
+                meta.name, meta, value, metrics.rates.get(number)))
         return "\n".join(lines)
 
-    def format(self, key, record):
+    def format_timeout(self, key):
+        spaces = " " * (self.max_key_length - len(key) + 1)
+        return "%s:%stimeout" % (key, spaces)
+
+    def format(self, key, meta, value, rate=None):
         spaces = " " * (self.max_key_length - len(key) + 1)
-        if record.get("unit") == "bytes":
-            return "%s:%s%s" % (
-                key, spaces, human_size_format(record.get("value")))
+        if meta.unit == "bytes":
+            line = "%s:%s%s" % (key, spaces, human_size_format(value))
         else:
-            return "%s:%s%s %s" % (
-                key, spaces, record.get("value"), record.get("unit"))
+            line = "%s:%s%s %s" % (key, spaces, value, meta.unit)
+        if rate is not None:
+            line += " (%s)" % self.format_rate(meta, rate)
+        return line
+
+    def format_rate(self, meta, rate):
+        if meta.unit == "bytes":
+            return "%s/s" % human_size_format(rate)
+        return "%.2f %s/s" % (rate, meta.unit)
 
 
 class SubagentOutputFormatter:
     def output(self, metrics, pattern):
         lines = []
-        for key, record in metrics.items():
-            if record.get("value") is None:
+        index = metrics.get_index()
+        numbers = set(index.glob(pattern))
+        for number in index.oids:
+            value = metrics.values[number]
+            if value is None or number not in numbers:
                 continue
-            lines.append(self.format(key, record))
+            lines.append(self.format(metrics.metas[number], value))
         return "\n".join(lines)
 
-    def format(self, key, record):
-        return "%s = %s" % (record.get("snmp"), record.get("value", 0))
+    def format(self, meta, value):
+        return "%s = %s" % (meta.snmp, value)
+
+
+class JSONOutputFormatter:
+    """One JSON object per leaf and line, in OID order.
+
+    ``write`` sends the lines of a result to a stream as soon as they
+    are formatted, so results may be written while others are still
+    collected.
+    """
+
+    def output(self, metrics, pattern):
+        return "\n".join(self.get_lines(metrics, pattern))
+
+    def write(self, stream, metrics, pattern=None, timestamp=None):
+        for line in self.get_lines(metrics, pattern or '*', timestamp):
+            stream.write(line)
+            stream.write("\n")
+        stream.flush()
+
+    def get_lines(self, metrics, pattern, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        index = metrics.get_index()
+        numbers = set(index.glob(pattern))
+        for number in index.oids:
+            if number not in numbers:
+                continue
+            yield self.format(
+                metrics.metas[number], metrics.values[number], timestamp,
+                number in metrics.timeouts, metrics.rates.get(number))
+
+    def format(self, meta, value, timestamp, timeout=False, rate=None):
+        leaf = {
+            'name': meta.name,
+            'oid': meta.oid,
+            'snmp': meta.snmp,
+            'type': meta.type,
+            'unit': meta.unit,
+            'value': value,
+            'timestamp': timestamp,
+        }
+        if timeout:
+            leaf['timeout'] = True
+        if rate is not None:
+            leaf['rate'] = rate
+        return json.dumps(leaf, sort_keys=True, separators=(',', ':'))
+
+
+class PrometheusOutputFormatter:
+    """Text exposition format of Prometheus.
+
+    Leaves of table rows are samples of their field's metric family
+    with the row index as the ``index`` label. Counters get ``_total``
+    and names get their unit as a suffix, leaves without a numeric
+    value are left out.
+    """
+    types = {
+        'Counter32': 'counter',
+        'Counter64': 'counter',
+    }
+    invalid = re.compile(r'[^a-zA-Z0-9_:]')
+
+    def __init__(self):
+        self.names = {}
+
+    def output(self, metrics, pattern):
+        families = collections.OrderedDict()
+        index = metrics.get_index()
+        numbers = set(index.glob(pattern))
+        for number in index.oids:
+            if number not in numbers:
+                continue
+            value = self.format_value(metrics.values[number])
+            if value is None:
+                continue
+            meta = metrics.metas[number]
+            name, type = self.get_family(meta)
+            family = families.get(name)
+            if family is None:
+                family = families[name] = [self.format_header(
+                    name, type, meta.description)]
+            family.append(self.format(name, meta, value))
+        return "".join(
+            "\n".join(family) + "\n" for family in families.values())
+
+    def get_family(self, meta):
+        key = (meta.get_field_name(), meta.type, meta.unit)
+        if key not in self.names:
+            name, type, unit = key
+            name = self.invalid.sub('_', name)
+            unit = self.invalid.sub('_', unit)
+            if unit and not name.endswith('_' + unit):
+                name += '_' + unit
+            type = self.types.get(type, 'gauge')
+            if type == 'counter':
+                name += '_total'
+            self.names[key] = (name, type)
+        return self.names[key]
+
+    def format_header(self, name, type, description):
+        lines = []
+        if description:
+            lines.append("# HELP %s %s" % (name, ' '.join(
+                description.replace('\\', '\\\\').split())))
+        lines.append("# TYPE %s %s" % (name, type))
+        return "\n".join(lines)
+
+    def format(self, name, meta, value):
+        if meta.index is None:
+            return "%s %s" % (name, value)
+        index = meta.index.replace('\\', '\\\\').replace('"', '\\"')
+        return '%s{index="%s"} %s' % (
+            name, index.replace('\n', '\\n'), value)
+
+    def format_value(self, value):
+        if isinstance(value, bool):
+            return str(int(value))
+        if isinstance(value, (int, long)):
+            return str(value)
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
 
 
 class MIBOutputFormatter:
-    def __init__(self, templatedir):
+    def __init__(self, templatedir, workers=4):
         logger.info("template dir: %s", templatedir)
         self.templatedir = templatedir
+        self.workers = workers
         self.env = jinja2.Environment()
         self.env.loader = jinja2.FileSystemLoader(self.templatedir)
+        self.snmp_names = {}
+        umask = os.umask(0)
+        os.umask(umask)
+        self.mode = 0666 & ~umask
 
-    def output(self, objects, directory):
+    def output(self, metrics, directory):
+        """Render all templates to ``directory``, returns file names."""
         self.create_directory(directory)
-        objects = self.format(objects)
-        for name, template in self.get_templates():
-            logger.info("generating: %s", name)
-            mib = template.render({"objects": objects})
-            self.save_mib(mib, name, directory)
+        objects = self.format(metrics)
+        templates = list(self.get_templates())
+        tasks = [(name, None, functools.partial(
+                  self.render, template, objects, name, directory))
+                 for name, template in templates]
+        pool = WorkerPool(self.workers)
+        done = set(name for name, _ in pool.run(tasks))
+        failed = [name for name, _ in templates if name not in done]
+        if failed:
+            raise RuntimeError("could not generate: %s" % ", ".join(failed))
+        return [name for name, _ in templates]
 
-    def format(self, objects):
+    def render(self, template, objects, name, directory):
+        logger.info("generating: %s", name)
+        self.save_mib(template.render({"objects": objects}), name, directory)
+
+    def format(self, metrics):
+        """Tree of objects keyed by (parent, child) snmp names.
+
+        Every leaf adds the edges of its path with the last component
+        of their oid, edges to leaves also get the leaf metadata.
+        """
         result = collections.OrderedDict()
-        for key, value in objects.items():
-            pairs = zip(value["name"].split("."), value["oid"].split("."))
-            parent = pairs[0][0]
-            for name, oid in pairs[1:]:
-                child = ".".join([parent, name])
-                if (parent, child) not in result:
-                    result_key = (get_snmp_name(parent), get_snmp_name(child))
-                    if child == key:
-                        result[result_key] = copy.deepcopy(value)
-                    result.setdefault(result_key, {})["oid"] = oid
-                    parent = child
+        for number in metrics.get_index().oids:
+            meta = metrics.metas[number]
+            names = meta.name.split(".")
+            oids = meta.oid.split(".")
+            parent = names[0]
+            for name, oid in zip(names[1:], oids[1:]):
+                child = parent + "." + name
+                key = (self.get_snmp_name(parent), self.get_snmp_name(child))
+                if child == meta.name:
+                    result[key] = dict(meta.as_dict(), oid=oid)
+                else:
+                    result.setdefault(key, {"oid": oid})
+                parent = child
         return result
 
+    def get_snmp_name(self, name):
+        if name not in self.snmp_names:
+            self.snmp_names[name] = get_snmp_name(name)
+        return self.snmp_names[name]
+
     def get_templates(self):
         for filename in glob.glob("%s/*" % self.templatedir):
             basename = os.path.basename(filename)
             yield basename, self.env.get_template(basename)
 
     def save_mib(self, mib, name, directory):
-        with open(os.path.join(directory, name), "w") as h:
-            h.write(mib)
+        write_atomic(os.path.join(directory, name), mib.encode("utf-8"),
+                     self.mode)
 
     def create_directory(self, directory):
-        if os.path.isdir(directory):
-            shutil.rmtree(directory)
-        os.makedirs(directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
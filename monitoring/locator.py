@@ -1,10 +1,16 @@
+import functools
+import json
 import logging
 import os
+import pwd
 import re
+import socket
+import threading
+import time
 
-import yaml
-
+from monitoring.cache import load_yaml, write_atomic
 from monitoring.config import get_default_locator_config
+from monitoring.executor import WorkerPool
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +22,23 @@ class Locator(object):
     def endpoint(self):
         raise NotImplementedError('abstract method is called')
 
+    def identity(self):
+        return self.__class__.__name__
+
+    def get_state(self):
+        return {}
+
+    def restore(self, state):
+        pass
+
+    def revalidate(self):
+        return self.exists()
+
+    def may_exist(self):
+        """Cheap check whether a service not found before may be up now,
+        false keeps the cached negative result."""
+        return True
+
 
 class DummyLocator(Locator):
     def __init__(self, *args, **kwargs):
@@ -31,35 +54,149 @@ class DummyLocator(Locator):
 
 
 class HttpServiceLocator(Locator):
-    def __init__(self, host="localhost", port=80):
+    def __init__(self, host="localhost", port=80,
+                 connect_timeout=1.0, read_timeout=2.0):
+        self.host = host
+        self.port = int(port)
         self.url = "http://%s:%d" % (host, int(port))
+        self.timeout = (float(connect_timeout), float(read_timeout))
 
     def exists(self):
         import requests
 
         try:
-            response = requests.head(self.url)
+            response = requests.head(self.url, timeout=self.timeout)
             return response.status_code < 400 or \
                 response.status_code == 405
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
             return False
 
     def endpoint(self):
         return self.url
 
+    def identity(self):
+        return self.url
+
+    def revalidate(self):
+        try:
+            connection = socket.create_connection(
+                (self.host, self.port), self.timeout[0])
+        except (socket.error, socket.timeout):
+            return False
+        connection.close()
+        return True
+
+    def may_exist(self):
+        return self.revalidate()
+
+
+class ProcessScanner(object):
+    """One pass over the process table matching command lines.
+
+    Process locators point jmxterm to a JVM, so command lines without
+    ``prefilter`` are skipped before the patterns, all patterns are
+    matched at once. The owner is resolved only for matched processes.
+    psutil is used where there is no /proc.
+    """
+    proc_dir = '/proc'
+    prefilter = 'java'
+
+    def __init__(self, patterns):
+        self.pattern = re.compile(
+            '|'.join('(?:%s)' % x for x in sorted(patterns)), re.S | re.M)
+        self.usernames = {}
+
+    def scan(self):
+        if os.path.isdir(self.proc_dir):
+            return self.scan_proc()
+        return self.scan_psutil()
+
+    def scan_proc(self):
+        processes = []
+        pids = sorted(int(x) for x in os.listdir(self.proc_dir) if x.isdigit())
+        for pid in pids:
+            path = os.path.join(self.proc_dir, str(pid))
+            try:
+                with open(os.path.join(path, 'cmdline'), 'rb') as h:
+                    cmdline = h.read()
+                if not self.is_candidate(cmdline):
+                    continue
+                cmdline = cmdline.rstrip('\0').replace('\0', ' ')
+                if self.pattern.match(cmdline):
+                    processes.append((cmdline, pid, self.get_username(
+                        os.stat(path).st_uid)))
+            except (IOError, OSError), e:
+                logger.debug("%s: %s", path, e)
+        return processes
+
+    def scan_psutil(self):
+        import psutil
+
+        processes = []
+        for proc in psutil.process_iter():
+            try:
+                cmdline = " ".join(proc.cmdline)
+                if self.is_candidate(cmdline) and self.pattern.match(cmdline):
+                    processes.append((cmdline, proc.pid, proc.username))
+            except psutil.AccessDenied, e:
+                logger.debug("psutil: denied: %s", e)
+            except psutil.Error, e:
+                logger.debug("psutil: %s", e)
+        return processes
+
+    @classmethod
+    def get_start_time(cls, pid):
+        """Start time of the process in clock ticks after boot."""
+        try:
+            with open(os.path.join(cls.proc_dir, str(pid), 'stat')) as h:
+                return int(h.read().rsplit(')', 1)[1].split()[19])
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+    def is_candidate(self, cmdline):
+        return self.prefilter is None or self.prefilter in cmdline
+
+    def get_username(self, uid):
+        if uid not in self.usernames:
+            try:
+                self.usernames[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.usernames[uid] = str(uid)
+        return self.usernames[uid]
+
 
 class ProcessLocator(Locator):
     processes = None
+    patterns = None
+    lock = threading.Lock()
 
     def __init__(self, pattern=".*?"):
         self.pattern = pattern
         self.pid = None
         self.user = None
+        self.start_time = None
 
     def endpoint(self):
         if self.pid is not None and self.user is not None:
             return "process://%s@%d" % (self.user, self.pid)
 
+    def identity(self):
+        return "process:%s" % self.pattern
+
+    def get_state(self):
+        return {'pid': self.pid, 'user': self.user,
+                'start_time': ProcessScanner.get_start_time(self.pid)}
+
+    def restore(self, state):
+        self.pid = state.get('pid')
+        self.user = state.get('user')
+        self.start_time = state.get('start_time')
+
+    def revalidate(self):
+        return self.start_time is not None and \
+            ProcessScanner.get_start_time(self.pid) == self.start_time
+
     def exists(self):
         for cmdline, pid, username in self.get_processes():
             if re.match(self.pattern, cmdline, re.S | re.M):
@@ -68,25 +205,26 @@ class ProcessLocator(Locator):
                 return True
         return False
 
-    def get_processes(self):
-        import psutil
+    @staticmethod
+    def reset(patterns=None):
+        """Drop scanned processes, the next scan matches ``patterns``."""
+        with ProcessLocator.lock:
+            ProcessLocator.processes = None
+            ProcessLocator.patterns = patterns
 
-        if ProcessLocator.processes is not None:
-            return ProcessLocator.processes
-
-        processes = []
-        for proc in psutil.process_iter():
-            try:
-                cmdline = " ".join(proc.cmdline)
-                processes.append((cmdline, proc.pid, proc.username))
-            except psutil.AccessDenied, e:
-                logger.debug("psutil: denied: %s", e)
-            except psutil.Error, e:
-                logger.debug("psutil: %s", e)
-
-        ProcessLocator.processes = processes
+    def get_processes(self):
+        with ProcessLocator.lock:
+            patterns = ProcessLocator.patterns or set()
+            if ProcessLocator.processes is None or \
+                    self.pattern not in patterns:
+                patterns = set(patterns) | set([self.pattern])
+                ProcessLocator.patterns = patterns
+                ProcessLocator.processes = self.scan_processes(patterns)
         return ProcessLocator.processes
 
+    def scan_processes(self, patterns):
+        return ProcessScanner(patterns).scan()
+
 
 class ServiceLocator(object):
     INSTANCE = None
@@ -97,8 +235,10 @@ class ServiceLocator(object):
                 super(ServiceLocator, cls).__new__(cls, *args, **kwargs)
         return ServiceLocator.INSTANCE
 
-    def __init__(self):
+    def __init__(self, workers=16):
         self.locators = {}
+        self.pool = WorkerPool(workers)
+        self.cache = None
 
     def add(self, service_name, service_locator):
         if not isinstance(service_locator, Locator):
@@ -106,11 +246,54 @@ class ServiceLocator(object):
 
         self.locators[service_name] = service_locator
 
-    def exists(self):
-        for name, locator in self.locators.items():
-            if locator.exists():
-                logger.info("%s found", name)
-                yield name
+    def exists(self, timeout=None):
+        ProcessLocator.reset(set(
+            x.pattern for x in self.locators.values()
+            if isinstance(x, ProcessLocator)))
+        cached = {}
+        if self.cache is not None:
+            cached = self.cache.load()
+        tasks = [(name, None,
+                  functools.partial(self.locate, locator, cached.get(name)))
+                 for name, locator in self.locators.items()]
+        # services not located before the caller stops keep their entries
+        entries = dict((name, entry) for name, entry in cached.items()
+                       if name in self.locators)
+        try:
+            for name, (found, entry) in self.pool.run(tasks, timeout):
+                entries[name] = entry
+                if found:
+                    logger.info("%s found", name)
+                    yield name
+        finally:
+            if self.cache is not None:
+                self.cache.save(entries)
+
+    def locate(self, locator, entry=None):
+        """Check a service, a cached discovery is revalidated first.
+
+        A service cached as not found is probed again only if its
+        locator reports it may exist now, e.g. its port accepts
+        connections, so a started service is found on the next run.
+        """
+        if entry is not None and entry.get('locator') == locator.identity():
+            if not entry.get('found'):
+                if not locator.may_exist():
+                    return False, entry
+                logger.info("%s may be up, rediscover", locator.identity())
+            else:
+                locator.restore(entry.get('state') or {})
+                if locator.revalidate():
+                    return True, entry
+                logger.info("%s changed, rediscover", locator.identity())
+
+        found = locator.exists()
+        return found, {
+            'time': time.time(),
+            'locator': locator.identity(),
+            'found': found,
+            'state': locator.get_state() if found else None,
+        }
 
     def endpoint(self, name):
         return self.locators[name].endpoint()
@@ -126,9 +309,7 @@ class ServiceLocator(object):
             self.add(name, klass(**args))
 
     def read_config(self, filename):
-        with open(filename) as h:
-            config = h.read()
-        return yaml.load(config)
+        return load_yaml(filename)
 
     def get_class_and_args(self, args, updates):
         for key, value in updates.items():
@@ -137,3 +318,38 @@ class ServiceLocator(object):
         klass = globals()[args["class"]]
         del args["class"]
         return klass, args
+
+
+class DiscoveryCache(object):
+    """Discovered services kept between runs for ``ttl`` seconds.
+
+    A found service is revalidated by its locator, a service that was
+    not found is not looked for again until the entry expires.
+    """
+
+    def __init__(self, filename, ttl=300):
+        self.filename = filename
+        self.ttl = ttl
+
+    def load(self):
+        try:
+            with open(self.filename) as h:
+                entries = json.load(h)
+        except IOError:
+            return {}
+        except ValueError, e:
+            logger.warn("broken discovery cache %s: %s", self.filename, e)
+            return {}
+        now = time.time()
+        return dict((name, entry) for name, entry in entries.items()
+                    if 0 <= now - entry.get('time', 0) < self.ttl)
+
+    def save(self, entries):
+        try:
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            write_atomic(self.filename, json.dumps(entries))
+        except (IOError, OSError), e:
+            logger.warn("could not write discovery cache %s: %s",
+                        self.filename, e)
@@ -0,0 +1,226 @@
+import bisect
+import fnmatch
+import re
+
+
+def intern_string(value):
+    if isinstance(value, str):
+        return intern(value)
+    return value
+
+
+class LeafMeta(object):
+    """Static description of a leaf, shared by all collected values.
+
+    Leaves of table rows have the row ``index`` as the last part of
+    their name and OID.
+    """
+    __slots__ = ('name', 'oid', 'snmp', 'type', 'unit', 'description',
+                 'index')
+
+    def __init__(self, name, oid, snmp, type='OCTET STRING', unit='',
+                 description=None, index=None):
+        self.name = intern_string(name)
+        self.oid = intern_string(oid)
+        self.snmp = intern_string(snmp)
+        self.type = intern_string(type)
+        self.unit = intern_string(unit)
+        self.description = description
+        self.index = index
+
+    def get_field_name(self):
+        """Name of the table field for row leaves, the name otherwise."""
+        if self.index is None:
+            return self.name
+        return self.name[:-len(self.index) - 1]
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'oid': self.oid,
+            'snmp': self.snmp,
+            'type': self.type,
+            'unit': self.unit,
+            'description': self.description,
+        }
+
+    def __repr__(self):
+        return 'LeafMeta(%r)' % self.name
+
+
+class Metrics(object):
+    """Collected leaves: metadata and values stored by leaf id.
+
+    Adding a leaf that is already there replaces its value. Leaves cut
+    by the collection deadline have no value and are marked as timed
+    out, counters may have a rate.
+    """
+    __slots__ = ('metas', 'values', 'index', 'timeouts', 'rates', 'lookup')
+
+    def __init__(self):
+        self.metas = []
+        self.values = []
+        self.index = {}
+        self.timeouts = set()
+        self.rates = {}
+        self.lookup = None
+
+    def add(self, meta, value, timeout=False):
+        self.lookup = None
+        number = self.index.get(meta.name)
+        if number is None:
+            number = len(self.metas)
+            self.index[meta.name] = number
+            self.metas.append(meta)
+            self.values.append(value)
+        else:
+            self.metas[number] = meta
+            self.values[number] = value
+            self.rates.pop(number, None)
+        if timeout:
+            self.timeouts.add(number)
+        else:
+            self.timeouts.discard(number)
+
+    def update(self, other):
+        for number, meta in enumerate(other.metas):
+            self.add(meta, other.values[number], number in other.timeouts)
+            if number in other.rates:
+                self.set_rate(meta.name, other.rates[number])
+
+    def __len__(self):
+        return len(self.metas)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def leaves(self):
+        """Iterate over ``(meta, value)`` pairs."""
+        return zip(self.metas, self.values)
+
+    def get_index(self):
+        """Name and OID index of the leaves, built once per snapshot."""
+        if self.lookup is None:
+            self.lookup = MetricsIndex(self.metas)
+        return self.lookup
+
+    def get_meta(self, name):
+        return self.metas[self.index[name]]
+
+    def get_value(self, name):
+        return self.values[self.index[name]]
+
+    def is_timeout(self, name):
+        return self.index[name] in self.timeouts
+
+    def count_timeouts(self):
+        return len(self.timeouts)
+
+    def get_rate(self, name):
+        return self.rates.get(self.index[name])
+
+    def set_rate(self, name, rate):
+        self.rates[self.index[name]] = rate
+
+    def as_dict(self):
+        """Leaves as ``name => dict`` of metadata and value."""
+        result = {}
+        for number, meta in enumerate(self.metas):
+            leaf = meta.as_dict()
+            leaf['value'] = self.values[number]
+            if number in self.timeouts:
+                leaf['timeout'] = True
+            if number in self.rates:
+                leaf['rate'] = self.rates[number]
+            result[meta.name] = leaf
+        return result
+
+
+def get_oid_key(oid):
+    return tuple(int(x) if x.isdigit() else x for x in oid.split('.'))
+
+
+class MetricsIndex(object):
+    """Dotted name trie and sorted OIDs of leaves.
+
+    Trie nodes are ``[children, leaf id]`` lists. Queries return leaf
+    ids, names in sorted order, OIDs in numeric order.
+    """
+    __slots__ = ('metas', 'root', 'oids', 'oid_keys')
+    wildcards = re.compile(r'[*?[]')
+
+    def __init__(self, metas):
+        self.metas = metas
+        self.root = [{}, None]
+        oids = []
+        for number, meta in enumerate(metas):
+            node = self.root
+            for part in meta.name.split('.'):
+                child = node[0].get(part)
+                if child is None:
+                    child = node[0][part] = [{}, None]
+                node = child
+            node[1] = number
+            oids.append((get_oid_key(meta.oid), number))
+        oids.sort()
+        self.oids = [x[1] for x in oids]
+        self.oid_keys = [x[0] for x in oids]
+
+    def find(self, parts):
+        node = self.root
+        for part in parts:
+            node = node[0].get(part)
+            if node is None:
+                return None
+        return node
+
+    def walk(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node[1] is not None:
+                yield node[1]
+            stack.extend(node[0][x] for x in sorted(node[0], reverse=True))
+
+    def subtree(self, prefix):
+        """Leaves named ``prefix`` or ``prefix.*``."""
+        node = self.find(prefix.split('.'))
+        if node is None:
+            return []
+        return list(self.walk(node))
+
+    def has_children(self, prefix):
+        node = self.find(prefix.split('.'))
+        return node is not None and bool(node[0])
+
+    def glob(self, pattern):
+        """Leaves matching a fnmatch pattern.
+
+        Only the subtree of the complete name parts before the first
+        wildcard is matched.
+        """
+        literal = self.wildcards.split(pattern, 1)[0]
+        if literal == pattern:
+            node = self.find(pattern.split('.'))
+            if node is None or node[1] is None:
+                return []
+            return [node[1]]
+        node = self.find(literal.split('.')[:-1])
+        if node is None:
+            return []
+        match = re.compile(fnmatch.translate(pattern)).match
+        return [x for x in self.walk(node) if match(self.metas[x].name)]
+
+    def oid_subtree(self, oid):
+        """Leaves with OIDs in the subtree of ``oid``, in OID order."""
+        key = get_oid_key(oid)
+        result = []
+        position = bisect.bisect_left(self.oid_keys, key)
+        while position < len(self.oid_keys) and \
+                self.oid_keys[position][:len(key)] == key:
+            result.append(self.oids[position])
+            position += 1
+        return result
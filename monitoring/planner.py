@@ -0,0 +1,178 @@
+import fnmatch
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def parse_object_name(name):
+    """Split a JMX object name into domain and a set of key properties."""
+    domain, _, properties = name.partition(':')
+    return domain, frozenset(x.strip() for x in properties.split(','))
+
+
+def match_object_name(pattern, name):
+    """Match a JMX object name against an object name pattern."""
+    pattern_domain, pattern_properties = parse_object_name(pattern)
+    domain, properties = parse_object_name(name)
+    if not fnmatch.fnmatchcase(domain, pattern_domain):
+        return False
+    properties = dict(x.partition('=')[::2] for x in properties)
+    keys = set()
+    for item in pattern_properties:
+        if item == '*':
+            continue
+        key, _, value = item.partition('=')
+        if key not in properties or \
+                not fnmatch.fnmatchcase(properties[key], value):
+            return False
+        keys.add(key)
+    return '*' in pattern_properties or keys == set(properties)
+
+
+class QueryPlanner(object):
+    """Narrows hadoop /jmx queries to the attributes schemas use.
+
+    Hadoop's JMX servlet answers ``/jmx?get=Bean::Attribute`` with the
+    single attribute of the bean, so a request reading one attribute of
+    ``beans => 0`` is rewritten this way. Rewrites a server answers with
+    an unexpected payload are remembered and the original query is used
+    instead, failed requests do not reject a rewrite.
+    """
+    jmx_pattern = re.compile(r'^/jmx\?qry=([^&*?]+)$')
+
+    def __init__(self):
+        self.rejected = set()
+        self.lock = threading.Lock()
+
+    def plan(self, endpoint, query, addresses):
+        if not isinstance(query, basestring):
+            return query
+        match = self.jmx_pattern.match(query)
+        if match is None:
+            return query
+        attributes = set()
+        for parts in addresses:
+            if len(parts) < 3 or parts[:2] != ['beans', '0']:
+                return query
+            attributes.add(parts[2])
+        if len(attributes) != 1:
+            return query
+        planned = '/jmx?get=%s::%s' % (match.group(1), attributes.pop())
+        with self.lock:
+            if (endpoint, planned) in self.rejected:
+                return query
+        logger.debug('planned %s instead of %s', planned, query)
+        return planned
+
+    def is_accepted(self, planned, response):
+        try:
+            bean, attribute = planned.split('=', 1)[1].split('::')
+            beans = response['beans']
+            return len(beans) == 1 and \
+                parse_object_name(beans[0]['name']) == \
+                parse_object_name(bean) and \
+                attribute in beans[0] and \
+                beans[0].get('result') != 'ERROR'
+        except (AttributeError, KeyError, IndexError, TypeError,
+                ValueError):
+            return False
+
+    def reject(self, endpoint, planned):
+        logger.info('%s%s is not supported, use original query',
+                    endpoint, planned)
+        with self.lock:
+            self.rejected.add((endpoint, planned))
+
+
+class QueryCoalescer(object):
+    """Merges hadoop /jmx queries of one daemon into one request.
+
+    Queries of beans from the same domain are fetched with a single
+    pattern of their common key properties, ``beans`` of the response
+    are split back by the original queries. Sizes of responses, bytes of
+    their serialized beans, are remembered to merge queries only while
+    the combined response is cheaper than ``round_trip_cost`` bytes per
+    request. Queries are not merged before each of them was fetched
+    once, the combined query is then fetched once to learn its size.
+    Sizes live as long as the coalescer, so a single run never merges.
+    """
+    jmx_pattern = re.compile(r'^/jmx\?qry=([^&]+)$')
+
+    def __init__(self, round_trip_cost=4096):
+        self.round_trip_cost = round_trip_cost
+        self.sizes = {}
+        self.lock = threading.Lock()
+
+    def coalesce(self, endpoint, queries):
+        """Group queries, returns a list of (query, numbers) to fetch."""
+        groups = {}
+        result = []
+        for number, query in enumerate(queries):
+            bean = self.get_bean(query)
+            if bean is None or '*' in bean[0] or '?' in bean[0]:
+                result.append((query, [number]))
+            else:
+                groups.setdefault(bean[0], []).append((number, bean))
+
+        for domain, group in sorted(groups.items()):
+            numbers = [x[0] for x in group]
+            combined = self.get_combined_query(
+                domain, [x[1][1] for x in group])
+            if len(group) > 1 and self.is_cheaper(
+                    endpoint, combined, [queries[x] for x in numbers]):
+                logger.debug('coalesced %s into %s',
+                             [queries[x] for x in numbers], combined)
+                result.append((combined, numbers))
+            else:
+                result.extend((queries[x], [x]) for x in numbers)
+        return result
+
+    def get_bean(self, query):
+        if not isinstance(query, basestring):
+            return None
+        match = self.jmx_pattern.match(query)
+        if match is None:
+            return None
+        return parse_object_name(match.group(1))
+
+    def get_combined_query(self, domain, properties):
+        common = [x for x in reduce(frozenset.intersection, properties)
+                  if '*' not in x and '?' not in x]
+        return '/jmx?qry=%s:%s' % (domain, ','.join(sorted(common) + ['*']))
+
+    def is_cheaper(self, endpoint, combined, queries):
+        with self.lock:
+            sizes = [self.sizes.get((endpoint, x)) for x in queries]
+            combined_size = self.sizes.get((endpoint, combined))
+        if None in sizes:
+            return False
+        if combined_size is None:
+            logger.info('measuring %s%s', endpoint, combined)
+            return True
+        separate = sum(sizes) + self.round_trip_cost * len(queries)
+        return combined_size + self.round_trip_cost < separate
+
+    def split(self, queries, response):
+        """Split a coalesced response into responses of ``queries``."""
+        try:
+            beans = response['beans']
+        except (KeyError, TypeError):
+            return [response] * len(queries)
+        result = []
+        for query in queries:
+            pattern = self.jmx_pattern.match(query).group(1)
+            result.append({'beans': [
+                x for x in beans
+                if match_object_name(pattern, x.get('name', ''))]})
+        return result
+
+    def record(self, endpoint, query, response):
+        try:
+            size = len(json.dumps(response['beans'], separators=(',', ':')))
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.lock:
+            self.sizes[(endpoint, query)] = size
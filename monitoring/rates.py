@@ -0,0 +1,138 @@
+import logging
+import os
+import struct
+import time
+
+from monitoring.cache import write_atomic
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = {
+    'Counter32': 2 ** 32,
+    'Counter64': 2 ** 64,
+}
+
+
+class RateStore(object):
+    """Previous values of counter leaves kept in a binary file.
+
+    The file is a ``<4sHI`` header (magic, version, count), the size of
+    newline separated names as ``<I`` and the names, then ``count``
+    timestamps as ``<d`` and ``count`` values as ``<Q``. Counters not
+    seen for ``max_age`` seconds are dropped.
+    """
+    magic = 'HMRS'
+    version = 1
+    header = struct.Struct('<4sHI')
+    size = struct.Struct('<I')
+
+    def __init__(self, filename, max_age=3600):
+        self.filename = filename
+        self.max_age = max_age
+
+    def update(self, metrics, now=None):
+        """Set ``rate`` of counter leaves, per second since the last run."""
+        if now is None:
+            now = time.time()
+        previous = self.read()
+        names, values, ranges = self.get_counters(metrics)
+        rates = self.get_rates(
+            [previous.get(x, (None, None)) for x in names],
+            values, ranges, now)
+        for name, rate in zip(names, rates):
+            if rate is not None:
+                metrics.set_rate(name, rate)
+
+        snapshot = dict((name, entry) for name, entry in previous.items()
+                        if now - entry[0] < self.max_age)
+        snapshot.update(zip(names, [(now, x) for x in values]))
+        self.write(snapshot)
+        return metrics
+
+    def get_counters(self, metrics):
+        names = []
+        values = []
+        ranges = []
+        for meta, value in metrics.leaves():
+            limit = COUNTERS.get(meta.type)
+            if limit is None:
+                continue
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= value < limit:
+                names.append(meta.name)
+                values.append(value)
+                ranges.append(limit)
+        return names, values, ranges
+
+    def get_rates(self, previous, values, ranges, now):
+        """Rates of all counters in one pass over aligned sequences."""
+        deltas = map(self.get_delta, [x[1] for x in previous], values, ranges)
+        return [
+            None if delta is None or now <= last_time else
+            float(delta) / (now - last_time)
+            for (last_time, _), delta in zip(previous, deltas)]
+
+    def get_delta(self, last, value, limit):
+        """Counter increase since ``last``.
+
+        A counter less than its previous value wrapped around if the
+        wrapped delta is less than half of its range, otherwise it was
+        reset and counts from zero.
+        """
+        if last is None:
+            return None
+        if value >= last:
+            return value - last
+        if value + limit - last < limit / 2:
+            return value + limit - last
+        return value
+
+    def read(self):
+        try:
+            with open(self.filename, 'rb') as h:
+                data = h.read()
+        except IOError:
+            return {}
+        try:
+            magic, version, count = self.header.unpack_from(data)
+            if magic != self.magic or version != self.version:
+                raise ValueError('unknown format %r %d' % (magic, version))
+            if not count:
+                return {}
+            offset = self.header.size
+            size, = self.size.unpack_from(data, offset)
+            offset += self.size.size
+            names = data[offset:offset + size].decode('utf-8').split('\n')
+            offset += size
+            times = struct.unpack_from('<%dd' % count, data, offset)
+            offset += 8 * count
+            values = struct.unpack_from('<%dQ' % count, data, offset)
+            if len(names) != count:
+                raise ValueError('%d names for %d values' % (
+                    len(names), count))
+        except (struct.error, ValueError, UnicodeDecodeError), e:
+            logger.warn('broken rate snapshot %s: %s', self.filename, e)
+            return {}
+        return dict(zip(names, zip(times, values)))
+
+    def write(self, snapshot):
+        names = sorted(snapshot)
+        count = len(names)
+        data = '\n'.join(names).encode('utf-8')
+        try:
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            write_atomic(self.filename, ''.join([
+                self.header.pack(self.magic, self.version, count),
+                self.size.pack(len(data)),
+                data,
+                struct.pack('<%dd' % count, *[snapshot[x][0] for x in names]),
+                struct.pack('<%dQ' % count, *[snapshot[x][1] for x in names]),
+            ]))
+        except (IOError, OSError), e:
+            logger.warn('could not write rate snapshot %s: %s',
+                        self.filename, e)
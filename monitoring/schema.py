@@ -1,10 +1,16 @@
 import logging
-import yaml
 import os
+import functools
 import glob
+import operator
 import re
 import binascii
+import threading
 
+from monitoring.cache import load_yaml
+from monitoring.executor import TIMED_OUT
+from monitoring.extractor import minimize_paths
+from monitoring.metrics import LeafMeta, Metrics
 from monitoring.utils import get_snmp_name
 from monitoring.config import get_default_schemas_dir
 
@@ -18,62 +24,175 @@ class Schema:
 
     def __init__(self, schema):
         self.schema = schema
+        self.mtime = None
         self.request_executor = (lambda x, y: None)
+        self.batch_executor = None
+        self.responses = {}
+        self.compiled = {}
+        self.paths = {}
+        self.snmp_names = {}
+        self.row_metas = {}
+        self.last_row_metas = {}
+        self.filter_indexes = {}
+        self.request_paths = {}
 
     def set_request_executor(self, executor):
         assert callable(executor)
         self.request_executor = executor
 
+    def set_batch_executor(self, executor):
+        assert callable(executor)
+        self.batch_executor = executor
+
     def scan(self, oid, name):
         try:
-            return self.recursive_scan(oid, name, self.schema, {}, {})
+            compiled = self.compile(oid, name)
+            self.responses = self.prefetch(self.schema)
+            return self.scan_node(compiled, None, Metrics())
         except KeyError, e:
             raise KeyError('invalid schema, key error: %s' % e.message)
+        finally:
+            self.responses = {}
+            self.filter_indexes = {}
+            # rows gone since the last scan are dropped with their metas
+            self.last_row_metas = self.row_metas
+            self.row_metas = {}
+
+    def prefetch(self, node):
+        if self.batch_executor is None:
+            return {}
+        requests = self.get_requests(node)
+        responses = self.batch_executor(requests)
+        return dict(zip(map(id, requests), responses))
+
+    def get_requests(self, node):
+        requests = []
+        if 'requests' in node:
+            for request in node['requests']:
+                requests.append(request)
+                requests.extend(self.get_requests(request))
+        elif 'resources' in node:
+            for resource in node['resources']:
+                requests.extend(self.get_requests(resource))
+        return requests
+
+    def get_request_paths(self, request):
+        """Key paths of the response used under the request node.
+
+        Each path is a tuple of object keys up to the first list index or
+        function. None means the whole response is used.
+        """
+        if id(request) not in self.request_paths:
+            paths = []
+            for address in self.get_node_addresses(request):
+                path = []
+                for part in self.get_address_parts(address or ''):
+                    if self.part_is_digit(part) or \
+                            self.part_is_function(part):
+                        break
+                    path.append(part)
+                if not path:
+                    paths = None
+                    break
+                paths.append(tuple(path))
+            self.request_paths[id(request)] = minimize_paths(paths)
+        return self.request_paths[id(request)]
+
+    def get_request_addresses(self, request):
+        """Parts of every path used under the request node."""
+        return [self.get_address_parts(address or '')
+                for address in self.get_node_addresses(request)]
+
+    def get_node_addresses(self, node):
+        addresses = []
+        if 'requests' in node:
+            pass
+        elif 'resources' in node:
+            for resource in node['resources']:
+                addresses.extend(self.get_node_addresses(resource))
+        elif 'path' in node:
+            addresses.append(node['path'])
+        elif 'table' in node:
+            addresses.append(node['table']['path'])
+        return addresses
 
-    def recursive_scan(self, oid, name, node, data, result):
+    def compile(self, oid, name):
+        """Compile the schema for the given base oid and name.
+
+        The result is a tree of ``(kind, ...)`` tuples with precompiled
+        paths and leaf metadata, so a scan only walks the data.
+        """
+        if (oid, name) not in self.compiled:
+            self.compiled[(oid, name)] = self.compile_node(
+                oid, name, self.schema)
+        return self.compiled[(oid, name)]
+
+    def compile_node(self, oid, name, node):
         oid = self.get_oid(oid, node)
         name = self.get_name(name, node)
         logger.debug('oid: %s, name: %s: keys: %s', oid, name, node.keys())
 
         if 'requests' in node:
-            result = self.scan_requests_node(
-                oid, name, node['requests'], data, result)
+            return ('requests', [(x, self.compile_node(oid, name, x))
+                                 for x in node['requests']])
         elif 'resources' in node:
-            result = self.scan_resources_node(
-                oid, name, node['resources'], data, result)
+            return ('resources', [self.compile_node(oid, name, x)
+                                  for x in node['resources']])
         elif 'path' in node:
-            result[name] = self.get_leaf(oid, name, node, data)
+            return ('leaf', self.get_leaf_meta(oid, name, node),
+                    self.compile_path(node['path']))
         elif 'table' in node:
-            result = self.scan_table_node(
-                oid, name, node['table'], data, result)
-        return result
+            return self.compile_table_node(oid, name, node['table'])
+        return ('resources', [])
 
-    def scan_requests_node(self, oid, name, node, data, result):
-        for request in node:
-            data = self.request_executor(request['query'],
-                                         request.get('endpoint'))
-            result = self.recursive_scan(oid, name, request, data, result)
-        return result
+    def compile_table_node(self, oid, name, node):
+        fields = node['fields']
+        index_field = self.get_table_index_field(oid, name, fields)
+        compiled = []
+        for field in fields:
+            meta = self.get_leaf_meta(
+                self.get_oid(oid, field), self.get_name(name, field), field)
+            compiled.append((meta, self.compile_path(field['path'])))
+        return ('table', self.compile_path(node['path']),
+                self.compile_path(index_field['path']), compiled)
 
-    def scan_resources_node(self, oid, name, node, data, result):
-        for resource in node:
-            result = self.recursive_scan(oid, name, resource, data, result)
+    def scan_node(self, compiled, data, result):
+        kind = compiled[0]
+        if kind == 'requests':
+            for request, child in compiled[1]:
+                self.scan_node(child, self.get_response(request), result)
+        elif kind == 'resources':
+            for child in compiled[1]:
+                self.scan_node(child, data, result)
+        elif kind == 'leaf':
+            meta, path = compiled[1:]
+            if data is TIMED_OUT:
+                result.add(meta, None, timeout=True)
+            else:
+                result.add(meta, self.walk_path(data, path))
+        elif kind == 'table':
+            self.scan_table_node(compiled, data, result)
         return result
 
-    def scan_table_node(self, oid, name, node, data, result):
-        fields = node['fields']
-        index_field = self.get_table_index_field(oid, name, fields)
-        values = self.get_value(data, node['path']) or [None] * len(fields)
+    def get_response(self, request):
+        if id(request) in self.responses:
+            return self.responses[id(request)]
+        return self.request_executor(request['query'],
+                                     request.get('endpoint'))
+
+    def scan_table_node(self, compiled, data, result):
+        _, path, index_path, fields = compiled
+        if data is TIMED_OUT:
+            for meta, _ in fields:
+                result.add(meta, None, timeout=True)
+            return result
+        values = self.walk_path(data, path) or [None] * len(fields)
         for value in values:
-            index = self.get_value(value, index_field['path'])
-            for field in fields:
-                field_oid = self.get_oid(oid, field)
-                field_name = self.get_name(name, field)
+            index = self.walk_path(value, index_path)
+            for meta, field_path in fields:
                 if index is not None:
-                    field_oid += '.' + str(index)
-                    field_name += '.' + str(index)
-                result[field_name] = self.get_leaf(
-                    field_oid, field_name, field, value)
+                    meta = self.get_row_meta(meta, index)
+                result.add(meta, self.walk_path(value, field_path))
         return result
 
     def get_table_index_field(self, oid, name, fields):
@@ -95,36 +214,63 @@ class Schema:
             name = '.'.join([name, node.get('name')])
         return name
 
-    def get_leaf(self, oid, name, node, data):
-        leaf = {}
-        leaf['value'] = self.get_value(data, node['path'])
-        leaf['type'] = node.get('type', 'OCTET STRING')
-        leaf['unit'] = node.get('unit', '')
-        leaf['description'] = node.get('description')
-        leaf['name'] = name
-        leaf['oid'] = oid
-        leaf['snmp'] = get_snmp_name(name)
-        return leaf
+    def get_leaf_meta(self, oid, name, node):
+        return LeafMeta(name, oid, self.get_snmp_name(name),
+                        node.get('type', 'OCTET STRING'),
+                        node.get('unit', ''),
+                        node.get('description'))
+
+    def get_row_meta(self, meta, index):
+        key = (meta.name, index)
+        if key not in self.row_metas:
+            row_meta = self.last_row_metas.get(key)
+            if row_meta is None:
+                index = str(index)
+                name = meta.name + '.' + index
+                row_meta = LeafMeta(
+                    name, meta.oid + '.' + index, get_snmp_name(name),
+                    meta.type, meta.unit, meta.description, index)
+            self.row_metas[key] = row_meta
+        return self.row_metas[key]
+
+    def get_snmp_name(self, name):
+        if name not in self.snmp_names:
+            self.snmp_names[name] = get_snmp_name(name)
+        return self.snmp_names[name]
 
     def get_value(self, data, address):
         if address is None:
             return data
+        return self.walk_path(data, self.compile_path(address))
+
+    def compile_path(self, address):
+        if address not in self.paths:
+            accessors = []
+            for part in self.get_address_parts(address or ''):
+                if self.part_is_digit(part):
+                    accessors.append(operator.itemgetter(int(part)))
+                elif self.part_is_function(part):
+                    func_name, func_args = self.parse_function(part)
+                    accessors.append(functools.partial(
+                        self.exec_function, func_name, func_args))
+                else:
+                    accessors.append(operator.itemgetter(part))
+            self.paths[address] = accessors
+        return self.paths[address]
+
+    def walk_path(self, data, accessors):
         if data is None:
             return None
 
         result = data
         try:
-            for part in self.get_address_parts(address):
+            for accessor in accessors:
                 if result is None:
                     return None
-                if self.part_is_digit(part):
-                    result = result[int(part)]
-                elif self.part_is_function(part):
-                    func_name, func_args = self.parse_function(part)
-                    result = self.exec_function(func_name, func_args, result)
-                else:
-                    result = result[part]
-            logger.debug('result: %r(%s)', result, result.__class__.__name__)
+                result = accessor(result)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('result: %r(%s)',
+                             result, result.__class__.__name__)
             return result
         except (KeyError, IndexError), e:
             logger.exception(e)
@@ -161,6 +307,10 @@ class Schema:
             raise RuntimeError('unknown function: %s', func_name)
 
     def exec_function_filter(self, args, data):
+        index = self.get_filter_index(sorted(args.keys()), data)
+        if index is not None:
+            return index.get(tuple(x[1] for x in sorted(args.items())))
+
         def filter_func(item):
             for name, value in args.items():
                 if item.get(name) != value:
@@ -176,6 +326,29 @@ class Schema:
             logger.warn('unexpected data: ' + e.message)
             return None
 
+    def get_filter_index(self, keys, data):
+        """Return dict of first items of ``data`` by values of ``keys``.
+
+        Indexes are built once per list and kept until the end of the scan,
+        so leaves filtering the same response share them. None is returned
+        if the list can not be indexed.
+        """
+        if not isinstance(data, list):
+            return None
+        cache_key = (id(data), tuple(keys))
+        cached = self.filter_indexes.get(cache_key)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+
+        index = {}
+        try:
+            for item in data:
+                index.setdefault(tuple(item.get(x) for x in keys), item)
+        except (AttributeError, TypeError):
+            index = None
+        self.filter_indexes[cache_key] = (data, index)
+        return index
+
     def exec_function_hash(self, args, data):
         key = args['key']
         value = data.get(key)
@@ -185,17 +358,22 @@ class Schema:
         return binascii.crc32(value) & 0xffffffff
 
     @staticmethod
-    def load_schema(name, schema_dir=None):
+    def get_filename(name, schema_dir=None):
         if schema_dir is None:
             schema_dir = Schema.schema_dir
-        filename = os.path.join(schema_dir, '%s.yaml' % name)
+        return os.path.join(schema_dir, '%s.yaml' % name)
+
+    @staticmethod
+    def load_schema(name, schema_dir=None):
+        filename = Schema.get_filename(name, schema_dir)
         if not os.path.exists(filename):
             logger.warn('could not load schema from: %s', filename)
             return None
         logger.info('schema %s from %s', name, filename)
-        with open(filename) as h:
-            data = yaml.load(h.read())
-        return Schema(data)
+        mtime = os.path.getmtime(filename)
+        result = Schema(load_yaml(filename))
+        result.mtime = mtime
+        return result
 
     @staticmethod
     def get_available_schemas(schema_dir=None):
@@ -205,3 +383,33 @@ class Schema:
             basename = os.path.basename(filename)
             basename, _ = os.path.splitext(basename)
             yield basename
+
+
+class SchemaPool(object):
+    """Schema instances reused by scans of following collections.
+
+    A schema keeps state of the running scan, so a scan acquires an
+    instance no other scan uses. Compiled paths and leaf metadata of an
+    instance are kept until its schema file changes.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, name, schema_dir=None):
+        try:
+            mtime = os.path.getmtime(Schema.get_filename(name, schema_dir))
+        except OSError:
+            mtime = None
+        with self.lock:
+            idle = self.schemas.setdefault((name, schema_dir), [])
+            while idle:
+                schema = idle.pop()
+                if schema.mtime == mtime:
+                    return schema
+        return Schema.load_schema(name, schema_dir=schema_dir)
+
+    def release(self, name, schema_dir, schema):
+        with self.lock:
+            self.schemas.setdefault((name, schema_dir), []).append(schema)
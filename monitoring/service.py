@@ -1,40 +1,105 @@
-import collections
-import fnmatch
+import functools
+import glob
+import hashlib
+import json
 import logging
 import os
 import yaml
 
-from monitoring.collector import Collector
+from monitoring.cache import YAMLCache
+from monitoring.collector import Collector, HTTPClient, JMXClient
+from monitoring.collector import HTTPTransport, JMXSessionPool, ResponseCache
+from monitoring.planner import QueryCoalescer, QueryPlanner
+from monitoring.cache import write_atomic
+from monitoring.config import get_default_schemas_dir
 from monitoring.config import get_default_templates_dir
-from monitoring.formatter import HumanOutputFormatter, SubagentOutputFormatter
-from monitoring.formatter import MIBOutputFormatter
-from monitoring.locator import ServiceLocator
-from monitoring.schema import Schema
+from monitoring.executor import Deadline, WorkerPool
+from monitoring.formatter import HumanOutputFormatter, JSONOutputFormatter
+from monitoring.formatter import SubagentOutputFormatter
+from monitoring.formatter import MIBOutputFormatter, PrometheusOutputFormatter
+from monitoring.locator import DiscoveryCache, ServiceLocator
+from monitoring.metrics import Metrics
+from monitoring.rates import RateStore
+from monitoring.schema import Schema, SchemaPool
 from monitoring.utils import get_snmp_name
 
 logger = logging.getLogger(__name__)
 
 
 class CollectorService:
-    def __init__(self, host, locator_config=None):
+    def __init__(self, host, locator_config=None,
+                 workers=8, http_workers=8, process_workers=2,
+                 discovery_timeout=None, transport=None, sessions=None,
+                 deadline=None, discovery_cache=None, rates=None):
         self.host = host
+        self.deadline = deadline
+        self.rates = rates
+        if transport is not None:
+            HTTPClient.transport = transport
+        if sessions is not None:
+            JMXClient.sessions = sessions
+        self.discovery_timeout = discovery_timeout
         self.locator = ServiceLocator()
         self.locator.load_config(locator_config, host=host)
+        self.locator.cache = discovery_cache
+        self.schemas = SchemaPool()
+        self.pool = WorkerPool(workers, {
+            'http': http_workers,
+            'process': process_workers,
+        })
         self.formatters = {
             'human': HumanOutputFormatter(),
             'subagent': SubagentOutputFormatter(),
+            'prometheus': PrometheusOutputFormatter(),
+            'json': JSONOutputFormatter(),
         }
 
-    def collect(self, oid, name, schema_dir=None):
-        metrics = {}
-        for schema_name in self.locator.exists():
-            schema = Schema.load_schema(schema_name, schema_dir=schema_dir)
+    def collect(self, oid, name, schema_dir=None, sink=None):
+        """Collect all located services.
+
+        ``sink`` is called with the metrics of every service as soon as
+        it is collected, rates are only set on the returned metrics.
+        """
+        metrics = Metrics()
+        cache = ResponseCache()
+        deadline = Deadline(self.deadline)
+        tasks = self.get_tasks(oid, name, schema_dir, cache, deadline)
+        for schema_name, result in self.pool.run(tasks, self.deadline):
+            logger.info('collected data: %s', schema_name)
+            if sink is not None:
+                sink(result)
+            metrics.update(result)
+        if self.rates is not None:
+            self.rates.update(metrics)
+        timeouts = metrics.count_timeouts()
+        if timeouts:
+            logger.warn('timed out leaves: %d', timeouts)
+        logger.info('response cache: %s', cache.stats())
+        if HTTPClient.transport is not None:
+            logger.info('http connections: %s', HTTPClient.transport.stats())
+        return metrics
+
+    def get_tasks(self, oid, name, schema_dir=None, cache=None,
+                  deadline=None):
+        deadline = deadline or Deadline()
+        discovery_timeout = deadline.budget(self.discovery_timeout)
+        for schema_name in self.locator.exists(discovery_timeout):
+            schema = self.schemas.acquire(schema_name, schema_dir)
             if schema is None:
                 continue
             logger.info('collecting data: %s', schema_name)
-            collector = Collector(self.locator.endpoint(schema_name), schema)
-            metrics.update(collector.collect(oid, name))
-        return metrics
+            collector = Collector(
+                self.locator.endpoint(schema_name), schema, cache, deadline)
+            yield (schema_name,
+                   collector.get_uri_schema(collector.endpoint),
+                   functools.partial(self.scan, collector, schema_name,
+                                     schema_dir, oid, name))
+
+    def scan(self, collector, schema_name, schema_dir, oid, name):
+        try:
+            return collector.collect(oid, name)
+        finally:
+            self.schemas.release(schema_name, schema_dir, collector.schema)
 
     def output(self, metrics, pattern=None, format=None):
         if pattern is None:
@@ -46,26 +111,112 @@ class CollectorService:
             services = yaml.load(handler.read()).get(self.host)
         if not services:
             return
+        index = metrics.get_index()
         for service in services:
-            if not fnmatch.filter(metrics.keys(), '%s.%s.*' % (name, service)):
+            if not index.has_children('%s.%s' % (name, service)):
                 logger.warn('seems service %s is unavailable on host %s',
                             get_snmp_name('%s.%s' % (name, service)),
                             self.host)
 
 
+def make_collector_service(host, config):
+    YAMLCache.default = YAMLCache(config.schemas.cache_dir)
+    if config.http.projection:
+        Collector.planner = QueryPlanner()
+    if config.http.coalesce:
+        Collector.coalescer = QueryCoalescer(config.http.round_trip_cost)
+    discovery_cache = None
+    if config.locator.cache_ttl:
+        discovery_cache = DiscoveryCache(
+            os.path.join(config.schemas.cache_dir, 'discovery-%s.json' % host),
+            config.locator.cache_ttl)
+    rates = None
+    if config.collector.rates:
+        rates = RateStore(
+            os.path.join(config.schemas.cache_dir, 'rates-%s.bin' % host))
+    sessions = None
+    if config.jmx.sessions:
+        sessions = JMXSessionPool(
+            idle_timeout=config.jmx.idle_timeout,
+            timeout=config.jmx.timeout,
+            check_interval=config.jmx.check_interval)
+    return CollectorService(
+        host,
+        workers=config.collector.workers,
+        http_workers=config.collector.http_workers,
+        process_workers=config.collector.process_workers,
+        discovery_timeout=config.locator.discovery_timeout,
+        transport=HTTPTransport(
+            pool_size=config.http.pool_size,
+            keepalive=config.http.keepalive,
+            connect_timeout=config.http.connect_timeout,
+            read_timeout=config.http.read_timeout,
+            streaming=config.http.streaming),
+        sessions=sessions,
+        deadline=config.collector.deadline,
+        discovery_cache=discovery_cache,
+        rates=rates)
+
+
 class MIBGeneratorService:
-    def __init__(self, templatedir=None):
+    state_file = '.generated'
+
+    def __init__(self, templatedir=None, workers=4):
         if templatedir is None:
             templatedir = get_default_templates_dir()
         self.templatedir = templatedir
+        self.workers = workers
+
+    def update(self, directory, oid, name, force=False):
+        """Generate mibs unless schemas and templates are unchanged.
+
+        The fingerprint of the inputs and the generated files are kept
+        in ``directory``, files of removed templates are deleted.
+        """
+        fingerprint = self.fingerprint(oid, name)
+        state = self.read_state(directory)
+        files = state.get('files', [])
+        if not force and state.get('fingerprint') == fingerprint and all(
+                os.path.exists(os.path.join(directory, x)) for x in files):
+            logger.info('mibs are up to date: %s', directory)
+            return False
+
+        generated = self.output(directory, self.generate(oid, name))
+        for filename in set(files) - set(generated):
+            path = os.path.join(directory, os.path.basename(filename))
+            if os.path.exists(path):
+                logger.info('removing: %s', path)
+                os.unlink(path)
+        write_atomic(os.path.join(directory, self.state_file), json.dumps(
+            {'fingerprint': fingerprint, 'files': generated}))
+        return True
+
+    def fingerprint(self, oid, name):
+        digest = hashlib.sha1(json.dumps([oid, name]))
+        for pattern in ('%s/*.yaml' % get_default_schemas_dir(),
+                        '%s/*' % self.templatedir):
+            for filename in sorted(glob.glob(pattern)):
+                with open(filename, 'rb') as h:
+                    content = h.read()
+                digest.update('%s\0%d\0' % (
+                    os.path.basename(filename), len(content)))
+                digest.update(content)
+        return digest.hexdigest()
+
+    def read_state(self, directory):
+        try:
+            with open(os.path.join(directory, self.state_file)) as h:
+                return json.load(h)
+        except (IOError, ValueError):
+            return {}
 
     def generate(self, oid, name):
-        objects = collections.OrderedDict()
+        metrics = Metrics()
         for schemaname in Schema.get_available_schemas():
             schema = Schema.load_schema(schemaname)
-            objects.update(schema.scan(oid, name))
-        return objects
+            metrics.update(schema.scan(oid, name))
+        return metrics
 
-    def output(self, directory, objects):
-        formatter = MIBOutputFormatter(self.templatedir)
-        formatter.output(objects, directory)
+    def output(self, directory, metrics):
+        formatter = MIBOutputFormatter(self.templatedir, self.workers)
+        return formatter.output(metrics, directory)
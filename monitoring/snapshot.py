@@ -0,0 +1,191 @@
+import fnmatch
+import logging
+import mmap
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotFile(object):
+    """Layout of a snapshot file shared with readers of other processes.
+
+    The file is a ``<4sHHQdII`` header (magic, version, flags, sequence,
+    timestamp, count, size of the key area), ``count`` ``<8I`` entries
+    in OID order (offset and length of the name, oid and snmp name in
+    the key area, offset and length of the value in the value area),
+    the key area and the value area. Strings are utf-8, values are
+    formatted as in the subagent output.
+    """
+    magic = 'HMSS'
+    version = 1
+    header = struct.Struct('<4sHHQdII')
+    entry = struct.Struct('<8I')
+
+    def __init__(self, filename):
+        self.filename = filename
+
+
+class SnapshotFileWriter(SnapshotFile):
+    """Replaces the snapshot file with every collected snapshot.
+
+    A new file is written and renamed over the old one, so a reader
+    keeps a consistent view of the file it has opened.
+    """
+
+    def __init__(self, filename):
+        SnapshotFile.__init__(self, filename)
+        self.sequence = None
+
+    def update(self, metrics):
+        if self.sequence is None:
+            self.sequence = self.read_sequence()
+        self.sequence += 1
+        try:
+            self.write(self.render(metrics, self.sequence, time.time()))
+        except (IOError, OSError), e:
+            logger.warn('could not write snapshot %s: %s', self.filename, e)
+
+    def render(self, metrics, sequence, timestamp):
+        entries = []
+        keys = []
+        values = []
+        keys_size = 0
+        values_size = 0
+        for number in metrics.get_index().oids:
+            value = metrics.values[number]
+            if value is None:
+                continue
+            meta = metrics.metas[number]
+            entry = []
+            for key in (meta.name, meta.oid, meta.snmp):
+                key = encode(key)
+                entry.extend((keys_size, len(key)))
+                keys.append(key)
+                keys_size += len(key)
+            value = encode(value)
+            entry.extend((values_size, len(value)))
+            values.append(value)
+            values_size += len(value)
+            entries.append(self.entry.pack(*entry))
+        return ''.join([self.header.pack(
+            self.magic, self.version, 0, sequence, timestamp,
+            len(entries), keys_size)] + entries + keys + values)
+
+    def read_sequence(self):
+        try:
+            with open(self.filename, 'rb') as h:
+                data = h.read(self.header.size)
+            magic, version, _, sequence, _, _, _ = \
+                self.header.unpack_from(data)
+        except (IOError, struct.error):
+            return 0
+        if magic != self.magic or version != self.version:
+            return 0
+        return sequence
+
+    def write(self, data):
+        from monitoring.cache import write_atomic
+
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0755)
+        write_atomic(self.filename, data, 0644)
+
+
+class SnapshotFileReader(SnapshotFile):
+    """Reads a snapshot file without the collector.
+
+    ``open`` maps the current file, the view stays the same until the
+    next ``open`` even if the writer replaces the file. A snapshot older
+    than ``max_age`` seconds is rejected, its daemon is not running.
+    """
+
+    def __init__(self, filename, max_age=None):
+        SnapshotFile.__init__(self, filename)
+        self.max_age = max_age
+        self.data = None
+        self.sequence = None
+        self.timestamp = None
+        self.count = 0
+        self.keys_offset = 0
+        self.values_offset = 0
+
+    def open(self):
+        with open(self.filename, 'rb') as h:
+            data = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            sequence, timestamp, count, keys_size = self.check(data)
+        except:
+            data.close()
+            raise
+        self.close()
+        self.data = data
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.count = count
+        self.keys_offset = self.header.size + count * self.entry.size
+        self.values_offset = self.keys_offset + keys_size
+        return self
+
+    def check(self, data):
+        if len(data) < self.header.size:
+            raise ValueError('truncated snapshot header')
+        magic, version, _, sequence, timestamp, count, keys_size = \
+            self.header.unpack_from(data)
+        if magic != self.magic or version != self.version:
+            raise ValueError('unknown snapshot format %r %d' % (
+                magic, version))
+        if len(data) < self.header.size + count * self.entry.size + \
+                keys_size:
+            raise ValueError('truncated snapshot of %d entries' % count)
+        age = time.time() - timestamp
+        if self.max_age is not None and age > self.max_age:
+            raise ValueError('snapshot is %d seconds old' % age)
+        return sequence, timestamp, count, keys_size
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def leaves(self):
+        """Iterate over ``(name, oid, snmp, value)`` in OID order."""
+        data = self.data
+        keys = self.keys_offset
+        values = self.values_offset
+        for position in xrange(self.count):
+            (name, name_size, oid, oid_size, snmp, snmp_size,
+             value, value_size) = self.entry.unpack_from(
+                data, self.header.size + position * self.entry.size)
+            if values + value + value_size > len(data):
+                raise ValueError('truncated snapshot value %d' % position)
+            yield (data[keys + name:keys + name + name_size],
+                   data[keys + oid:keys + oid + oid_size],
+                   data[keys + snmp:keys + snmp + snmp_size],
+                   data[values + value:values + value + value_size])
+
+    def output(self, pattern=None):
+        """Snapshot in the subagent output format."""
+        lines = []
+        for name, _, snmp, value in self.leaves():
+            if pattern is None or fnmatch.fnmatchcase(name, pattern):
+                lines.append('%s = %s' % (snmp, value))
+        return '\n'.join(lines)
+
+
+def read_snapshot(filename, pattern=None, max_age=None):
+    reader = SnapshotFileReader(filename, max_age).open()
+    try:
+        return reader.output(pattern)
+    finally:
+        reader.close()
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value
+    return str(value)
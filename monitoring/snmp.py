@@ -0,0 +1,150 @@
+import bisect
+import logging
+import threading
+
+from monitoring.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+TYPES = {
+    'Counter32': 'counter',
+    'Counter64': 'counter64',
+    'Gauge32': 'gauge',
+    'INTEGER': 'integer',
+    'Integer32': 'integer',
+    'TimeTicks': 'timeticks',
+    'IpAddress': 'ipaddress',
+    'OBJECT IDENTIFIER': 'objectid',
+    'OCTET STRING': 'string',
+}
+
+
+def parse_oid(oid):
+    return tuple(int(x) for x in oid.strip().strip('.').split('.') if x)
+
+
+def format_oid(oid):
+    return '.' + '.'.join(map(str, oid))
+
+
+class OIDIndex(object):
+    """Sorted numeric OID index of a metrics snapshot.
+
+    Schema OIDs start with the symbolic base (``hadoop``), it is replaced
+    by ``base_oid``, the numeric OID the base is registered at.
+    """
+
+    def __init__(self, metrics, base_oid):
+        self.base_oid = parse_oid(base_oid)
+        entries = []
+        for number in metrics.get_index().oids:
+            entry = self.make_entry(
+                metrics.metas[number], metrics.values[number])
+            if entry is not None:
+                entries.append(entry)
+        # already in oid order unless schemas use different base names
+        entries.sort()
+        self.oids = [x[0] for x in entries]
+        self.entries = entries
+
+    def make_entry(self, meta, value):
+        if value is None:
+            return None
+        try:
+            oid = self.base_oid + parse_oid(meta.oid.split('.', 1)[1])
+            kind = TYPES.get(meta.type, 'string')
+            value = self.format_value(kind, value)
+        except (IndexError, ValueError, TypeError), e:
+            logger.debug('skip %s: %s', meta.name, e)
+            return None
+        return oid, kind, value
+
+    def format_value(self, kind, value):
+        if kind in ('counter', 'counter64', 'gauge', 'timeticks'):
+            value = int(value)
+            if value < 0:
+                raise ValueError('negative value %d' % value)
+            return str(value)
+        if kind == 'integer':
+            return str(int(value))
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return ' '.join(str(value).splitlines())
+
+    def get(self, oid):
+        position = bisect.bisect_left(self.oids, oid)
+        if position < len(self.oids) and self.oids[position] == oid:
+            return self.entries[position]
+        return None
+
+    def get_next(self, oid):
+        position = bisect.bisect_right(self.oids, oid)
+        if position < len(self.oids):
+            return self.entries[position]
+        return None
+
+
+class PassPersistHandler(object):
+    """net-snmp pass_persist protocol over a pair of streams."""
+
+    def __init__(self, base_oid, stdin, stdout):
+        self.base_oid = base_oid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.index = OIDIndex(Metrics(), base_oid)
+        self.lock = threading.Lock()
+
+    def update(self, metrics):
+        index = OIDIndex(metrics, self.base_oid)
+        with self.lock:
+            self.index = index
+
+    def run(self):
+        while True:
+            command = self.readline()
+            if command is None:
+                return
+            command = command.lower()
+            if command == 'ping':
+                self.write('PONG')
+            elif command in ('get', 'getnext'):
+                self.reply(self.lookup(command, self.read_oid()))
+            elif command == 'set':
+                self.readline()
+                self.readline()
+                self.write('not-writable')
+            elif command:
+                logger.warn('unknown command: %s', command)
+                self.write('NONE')
+
+    def lookup(self, command, oid):
+        if oid is None:
+            return None
+        with self.lock:
+            index = self.index
+        if command == 'get':
+            return index.get(oid)
+        return index.get_next(oid)
+
+    def read_oid(self):
+        try:
+            return parse_oid(self.readline() or '')
+        except ValueError:
+            return None
+
+    def reply(self, entry):
+        if entry is None:
+            self.write('NONE')
+        else:
+            oid, kind, value = entry
+            self.write(format_oid(oid), kind, value)
+
+    def readline(self):
+        line = self.stdin.readline()
+        if not line:
+            return None
+        return line.strip()
+
+    def write(self, *lines):
+        self.stdout.write(''.join([x + '\n' for x in lines]))
+        self.stdout.flush()
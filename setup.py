@@ -13,11 +13,16 @@ setup(name='hadoop-monitoring-utility',
       package_dir={'monitoring': 'monitoring'},
       install_requires=['PyYAML >= 3.10',
                         'psutil >= 0.6.1',
-                        'requests >= 1.0',
+                        'requests >= 2.4',
                         'jinja2'],
+      extras_require={'streaming': ['ijson']},
       test_suite='tests',
       scripts=['bin/hadoop-monitoring-values',
-               'bin/hadoop-monitoring-generate-mibs'],
+               'bin/hadoop-monitoring-generate-mibs',
+               'bin/hadoop-monitoring-daemon',
+               'bin/hadoop-monitoring-snapshot',
+               'bin/hadoop-monitoring-pass-persist',
+               'bin/hadoop-monitoring-cluster'],
       license='GPLv2',
       url='https://github.com/go1dshtein/hadoop-monitoring-utility',
       include_package_data=True,
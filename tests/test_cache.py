@@ -0,0 +1,69 @@
+import pytest
+import marshal
+import mock
+import os
+
+import yaml
+
+from monitoring.cache import YAMLCache, load_yaml
+
+
+@pytest.fixture
+def filename(tmpdir):
+    result = tmpdir.join('test.yaml')
+    result.write('key: value\n')
+    return str(result)
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return YAMLCache(str(tmpdir.join('cache')))
+
+
+def test_load_without_directory(filename):
+    assert YAMLCache().load(filename) == {'key': 'value'}
+
+
+def test_load_yaml(filename, monkeypatch):
+    monkeypatch.setattr(YAMLCache, 'default', None)
+    assert load_yaml(filename) == {'key': 'value'}
+    assert isinstance(YAMLCache.default, YAMLCache)
+
+
+def test_load_cached(cache, filename, monkeypatch):
+    assert cache.load(filename) == {'key': 'value'}
+    assert len(os.listdir(cache.directory)) == 1
+    load = mock.Mock()
+    monkeypatch.setattr(yaml, 'load', load)
+    assert cache.load(filename) == {'key': 'value'}
+    assert load.mock_calls == []
+
+
+def test_load_not_marshallable(cache, tmpdir):
+    filename = tmpdir.join('date.yaml')
+    filename.write('key: 2016-01-01\n')
+    result = cache.load(str(filename))
+    assert str(result['key']) == '2016-01-01'
+    assert not os.path.exists(cache.directory)
+    assert cache.load(str(filename)) == result
+
+
+def test_load_changed(cache, filename):
+    assert cache.load(filename) == {'key': 'value'}
+    with open(filename, 'w') as h:
+        h.write('key: another value\n')
+    assert cache.load(filename) == {'key': 'another value'}
+
+
+def test_load_broken_cache(cache, filename):
+    cache.load(filename)
+    with open(cache.get_path(os.path.abspath(filename)), 'w') as h:
+        h.write('broken')
+    assert cache.load(filename) == {'key': 'value'}
+
+
+def test_load_unexpected_cache(cache, filename):
+    cache.load(filename)
+    with open(cache.get_path(os.path.abspath(filename)), 'wb') as h:
+        h.write(marshal.dumps([1, 2, 3]))
+    assert cache.load(filename) == {'key': 'value'}
@@ -0,0 +1,142 @@
+import pytest
+import socket
+import threading
+import time
+
+from monitoring.cluster import ClusterPoller, DNSCache
+from monitoring.collector import Collector
+from monitoring.daemon import CollectorLoop
+from monitoring.metrics import LeafMeta, Metrics
+
+LOCATORS = """
+hdfs.namenode:
+  class: HttpServiceLocator
+  port: 50070
+hdfs.datanode:
+  class: HttpServiceLocator
+  port: 50075
+yarn.resource-manager:
+  class: HttpServiceLocator
+  port: 8088
+yarn.resource-manager.jmx:
+  class: ProcessLocator
+  pattern: "^java.*ResourceManager$"
+"""
+
+SERVICE_MAP = {
+    'node0': ['hdfs.namenode', 'yarn.resource-manager'],
+    'node1': ['hdfs.datanode', 'zookeeper'],
+    'node2': ['hdfs.datanode'],
+}
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    result = []
+
+    def gethostbyname(host):
+        result.append(host)
+        if host == 'missing':
+            raise socket.gaierror('not found')
+        return '10.0.0.%s' % host[-1]
+    monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+    return result
+
+
+@pytest.fixture
+def poller(tmpdir, lookups):
+    filename = tmpdir.join('locator.yaml')
+    filename.write(LOCATORS)
+    return ClusterPoller(SERVICE_MAP, str(filename), per_host=1)
+
+
+def make_metrics(endpoint):
+    metrics = Metrics()
+    metrics.add(LeafMeta('hadoop.endpoint', 'hadoop.1', 'hadoopEndpoint'),
+                endpoint)
+    return metrics
+
+
+def test_dns_cache(lookups):
+    dns = DNSCache(ttl=300)
+    assert dns.resolve('node1') == '10.0.0.1'
+    assert dns.resolve('node1') == '10.0.0.1'
+    assert dns.resolve('missing') is None
+    assert dns.resolve('missing') is None
+    assert lookups == ['node1', 'missing']
+
+
+def test_dns_cache_expired(lookups):
+    dns = DNSCache(ttl=0, negative_ttl=0)
+    dns.resolve('node1')
+    dns.resolve('node1')
+    assert lookups == ['node1', 'node1']
+
+
+def test_get_targets(poller):
+    assert poller.get_targets() == [
+        ('node0', 'hdfs.namenode', 50070),
+        ('node0', 'yarn.resource-manager', 8088),
+        ('node1', 'hdfs.datanode', 50075),
+        ('node2', 'hdfs.datanode', 50075),
+    ]
+
+
+def test_collect(poller, monkeypatch):
+    monkeypatch.setattr(Collector, 'collect',
+                        lambda self, oid, name: make_metrics(self.endpoint))
+    snapshot = poller.collect('hadoop', 'hadoop')
+    assert snapshot.keys() == ['node0', 'node1', 'node2']
+    assert snapshot['node1'].get_value('hadoop.endpoint') == \
+        'http://10.0.0.1:50075'
+    assert snapshot['node2'].get_value('hadoop.endpoint') == \
+        'http://10.0.0.2:50075'
+
+
+def test_collect_loop(poller, lookups, monkeypatch):
+    monkeypatch.setattr(Collector, 'collect',
+                        lambda self, oid, name: make_metrics(self.endpoint))
+    snapshots = []
+    loop = CollectorLoop(poller, 'hadoop', 'hadoop')
+    loop.listeners.append(snapshots.append)
+    loop.collect()
+    schemas = dict((x, list(y)) for x, y in poller.schemas.schemas.items())
+    loop.collect()
+    assert len(snapshots) == 2
+    assert snapshots[1]['node2'].get_value('hadoop.endpoint') == \
+        'http://10.0.0.2:50075'
+    assert sorted(lookups) == ['node0', 'node1', 'node2']
+    assert poller.schemas.schemas == schemas
+
+
+def test_collect_per_host_limit(poller, monkeypatch):
+    lock = threading.Lock()
+    running = {}
+    peaks = {}
+
+    def collect(self, oid, name):
+        host = self.endpoint.split(':')[1]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peaks[host] = max(peaks.get(host, 0), running[host])
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+        return make_metrics(self.endpoint)
+    monkeypatch.setattr(Collector, 'collect', collect)
+    poller.collect('hadoop', 'hadoop')
+    assert max(peaks.values()) == 1
+
+
+def test_collect_unresolved(poller, monkeypatch):
+    monkeypatch.setattr(Collector, 'collect',
+                        lambda self, oid, name: make_metrics(self.endpoint))
+    poller.service_map = {'missing': ['hdfs.datanode']}
+    snapshot = poller.collect('hadoop', 'hadoop')
+    assert len(snapshot['missing']) == 0
+
+
+def test_output(poller):
+    snapshot = {'node1': make_metrics('http://node1:50075')}
+    assert poller.output(snapshot, 'hadoop.*', 'human') == \
+        'node1 hadoop.endpoint: http://node1:50075 '
@@ -1,10 +1,18 @@
 import pytest
 import mock
 import os
+import StringIO
+import threading
+import time
 
 import requests
 
-from monitoring.collector import Client, HTTPClient, Collector
+from monitoring import extractor
+from monitoring.collector import Client, HTTPClient, HTTPTransport, Collector
+from monitoring.collector import JMXClient, ResponseCache
+from monitoring.executor import Deadline, TIMED_OUT
+from monitoring.planner import QueryCoalescer, QueryPlanner
+from monitoring.schema import Schema
 
 
 @pytest.fixture
@@ -17,7 +25,10 @@ def client():
 
 @pytest.fixture
 def schema():
-    return mock.Mock()
+    result = mock.Mock()
+    result.get_request_paths.return_value = None
+    result.get_request_addresses.return_value = []
+    return result
 
 
 @pytest.fixture
@@ -45,7 +56,7 @@ def collector(http_collector, jmx_collector, request):
 def test_http_make_request(client, monkeypatch):
     response = mock.Mock()
     response.text = '{"key": "value"}'
-    monkeypatch.setattr(requests, 'get', lambda *a, **k: response)
+    monkeypatch.setattr(requests.Session, 'get', lambda *a, **k: response)
     assert client.make_request('/url') == {'key': 'value'}
 
 
@@ -57,17 +68,68 @@ def test_http_make_request_error(client, monkeypatch):
         raise requests.exceptions.HTTPError(400)
 
     response.raise_for_status.side_effect = status
-    monkeypatch.setattr(requests, 'get', lambda *a, **k: response)
+    monkeypatch.setattr(requests.Session, 'get', lambda *a, **k: response)
     assert client.make_request('/url') is None
 
 
 def test_http_make_request_no_json(client, monkeypatch):
     response = mock.Mock()
     response.text = '<xml><data/></xml>'
-    monkeypatch.setattr(requests, 'get', lambda *a, **k: response)
+    monkeypatch.setattr(requests.Session, 'get', lambda *a, **k: response)
     assert client.make_request('/url') is None
 
 
+def test_http_make_request_timeout(client, monkeypatch):
+    def get(*args, **kwargs):
+        raise requests.exceptions.ReadTimeout()
+
+    monkeypatch.setattr(requests.Session, 'get', get)
+    assert client.make_request('/url') is TIMED_OUT
+
+
+def test_http_make_request_deadline(monkeypatch):
+    timeouts = []
+
+    def get(self, url, **kwargs):
+        timeouts.append(kwargs['timeout'])
+        response = mock.Mock()
+        response.text = '{}'
+        return response
+
+    monkeypatch.setattr(requests.Session, 'get', get)
+    monkeypatch.setattr(HTTPClient, 'transport', HTTPTransport())
+    client = HTTPClient('http://localhost:50070', Deadline(2.5, grace=0.5))
+    assert client.make_request('/url') == {}
+    assert 1.5 < timeouts[0][0] <= 2 and 1.5 < timeouts[0][1] <= 2
+    client = HTTPClient('http://localhost:50070', Deadline(0))
+    assert client.make_request('/url') is TIMED_OUT
+    assert len(timeouts) == 1
+
+
+def test_transport_session(monkeypatch):
+    transport = HTTPTransport(pool_size=2)
+    session = transport.get_session('http://localhost:50070')
+    assert transport.get_session('http://localhost:50070') is session
+    assert transport.get_session('http://localhost:8088') is not session
+
+
+def test_transport_get(monkeypatch):
+    calls = []
+
+    def get(session, url, **kwargs):
+        calls.append((url, kwargs))
+
+    monkeypatch.setattr(requests.Session, 'get', get)
+    transport = HTTPTransport(keepalive=False,
+                              connect_timeout=1, read_timeout=2)
+    transport.get('http://localhost:50070', '/jmx', {'accept': 'json'})
+    assert calls == [('http://localhost:50070/jmx', {
+        'headers': {'accept': 'json', 'connection': 'close'},
+        'timeout': (1.0, 2.0)})]
+    assert transport.stats() == {
+        'requests': 1, 'connections': 0, 'reused': 1}
+
+
 @pytest.mark.parametrize('collector', ['jmx', 'http'], indirect=True)
 def test_collect(collector, schema):
     oid = 'oid'
@@ -82,3 +144,222 @@ def test_collect(collector, schema):
 @pytest.mark.parametrize('collector', ['jmx', 'http'], indirect=True)
 def test_get_uri_schema(collector, endpoint, expected):
     assert collector.get_uri_schema(endpoint) == expected
+
+
+def test_make_batch_request(http_collector, monkeypatch):
+    calls = []
+
+    def make_batch_request(client, queries, paths):
+        calls.append((client.endpoint, queries))
+        return [client.endpoint + query for query in queries]
+
+    monkeypatch.setattr(HTTPClient, 'make_batch_request', make_batch_request)
+    requests = [{'query': '/a'},
+                {'query': '/b', 'endpoint': 'http://remote:8088'},
+                {'query': '/c'}]
+    assert http_collector.make_batch_request(requests) == [
+        'http://localhost:50070/a',
+        'http://remote:8088/b',
+        'http://localhost:50070/c']
+    assert sorted(calls) == [
+        ('http://localhost:50070', ['/a', '/c']),
+        ('http://remote:8088', ['/b'])]
+
+
+def test_cache_get():
+    cache = ResponseCache()
+    fetch = mock.Mock(return_value={'key': 'value'})
+    assert cache.get('http://localhost', '/url', fetch) == {'key': 'value'}
+    assert cache.get('http://localhost', '/url', fetch) == {'key': 'value'}
+    assert cache.get('http://remote', '/url', fetch) == {'key': 'value'}
+    assert len(fetch.mock_calls) == 2
+    assert cache.stats() == {'hits': 1, 'misses': 2}
+
+
+def test_cache_get_query_dict():
+    cache = ResponseCache()
+    fetch = mock.Mock(return_value=1)
+    cache.get('process://unittest@1', {'bean': 'b', 'attr': 'a'}, fetch)
+    cache.get('process://unittest@1', {'attr': 'a', 'bean': 'b'}, fetch)
+    assert len(fetch.mock_calls) == 1
+
+
+def test_cache_get_in_flight():
+    cache = ResponseCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(
+        target=lambda: results.append(cache.get('http://h', '/q', fetch)))
+        for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['value'] * 4
+    assert calls == [1]
+
+
+def test_cache_get_failed():
+    cache = ResponseCache()
+
+    def fetch():
+        raise RuntimeError('unittest')
+
+    with pytest.raises(RuntimeError):
+        cache.get('http://h', '/q', fetch)
+    assert cache.get('http://h', '/q', fetch) is None
+
+
+def test_make_batch_request_cache(schema, monkeypatch):
+    calls = []
+
+    def make_batch_request(client, queries, paths):
+        calls.append(queries)
+        return [client.endpoint + query for query in queries]
+
+    monkeypatch.setattr(HTTPClient, 'make_batch_request', make_batch_request)
+    cache = ResponseCache()
+    collector = Collector('http://localhost:50070', schema, cache)
+    requests = [{'query': '/a'}, {'query': '/b'}, {'query': '/a'}]
+    expected = ['http://localhost:50070/a',
+                'http://localhost:50070/b',
+                'http://localhost:50070/a']
+    assert collector.make_batch_request(requests) == expected
+    assert collector.make_batch_request(requests) == expected
+    assert calls == [['/a', '/b']]
+    assert cache.stats() == {'hits': 4, 'misses': 2}
+
+
+@pytest.mark.parametrize('streaming,expected', [
+    (False, [['/jmx']]),
+    (True, [['/jmx'], ['/jmx']]),
+])
+def test_make_batch_request_cache_paths(streaming, expected, monkeypatch):
+    calls = []
+
+    def make_batch_request(client, queries, paths):
+        calls.append(queries)
+        return [{'beans': []} for query in queries]
+
+    monkeypatch.setattr(HTTPClient, 'make_batch_request', make_batch_request)
+    monkeypatch.setattr(HTTPClient, 'transport',
+                        HTTPTransport(streaming=streaming))
+    monkeypatch.setattr(extractor, 'is_available', lambda: True)
+    cache = ResponseCache()
+    for paths in ([('beans',)], [('beans', 'Used')]):
+        schema = mock.Mock()
+        schema.get_request_paths.return_value = paths
+        collector = Collector('http://localhost:50070', schema, cache)
+        assert collector.make_batch_request([{'query': '/jmx'}]) == [
+            {'beans': []}]
+    assert calls == expected
+
+
+def test_make_request_cache_jmx(monkeypatch):
+    calls = []
+
+    def make_batch_request(client, queries, paths=None):
+        calls.append(queries)
+        return [{'query': query} for query in queries]
+
+    monkeypatch.setattr(JMXClient, 'make_batch_request', make_batch_request)
+    monkeypatch.setattr(JMXClient, 'make_request',
+                        lambda client, query, paths=None:
+                        make_batch_request(client, [query])[0])
+    cache = ResponseCache()
+    schema = Schema({'requests': [
+        {'query': 'java.lang:type=Memory', 'resources': [
+            {'name': 'used', 'path': '=> used'}]},
+        {'query': 'java.lang:type=Threading', 'resources': [
+            {'name': 'threads', 'path': '=> query'}]}]})
+    collector = Collector('process://unittest@1111', schema, cache)
+    metrics = collector.collect('1', 'unit')
+    assert metrics.get_value('unit.threads') == 'java.lang:type=Threading'
+    collector.collect('1', 'unit')
+    assert collector.make_request('/jmx') == {'query': '/jmx'}
+    assert collector.make_request('/jmx') == {'query': '/jmx'}
+    assert calls == [['java.lang:type=Memory', 'java.lang:type=Threading'],
+                     ['/jmx']]
+    assert cache.stats() == {'hits': 3, 'misses': 3}
+
+
+def test_http_make_request_stream(client, monkeypatch):
+    response = mock.Mock()
+    response.raw = StringIO.StringIO('{"key": "value", "other": "value"}')
+    monkeypatch.setattr(requests.Session, 'get', lambda *a, **k: response)
+    monkeypatch.setattr(HTTPClient, 'transport', HTTPTransport(streaming=True))
+    assert client.make_request('/url', [('key',)]) == {'key': 'value'}
+    assert response.close.mock_calls == [mock.call()]
+
+
+def test_make_batch_request_planned(schema, monkeypatch):
+    calls = []
+
+    def make_batch_request(client, queries, paths):
+        calls.append(queries)
+        return [{'beans': []} for query in queries]
+
+    monkeypatch.setattr(HTTPClient, 'make_batch_request', make_batch_request)
+    monkeypatch.setattr(Collector, 'planner', QueryPlanner())
+    schema.get_request_addresses.return_value = [['beans', '0', 'Used']]
+    collector = Collector('http://localhost:50070', schema)
+    requests = [{'query': '/jmx?qry=java.lang:type=Memory'}]
+    assert collector.make_batch_request(requests) == [{'beans': []}]
+    assert collector.make_batch_request(requests) == [{'beans': []}]
+    assert calls == [['/jmx?get=java.lang:type=Memory::Used'],
+                     ['/jmx?qry=java.lang:type=Memory'],
+                     ['/jmx?qry=java.lang:type=Memory']]
+
+
+def test_make_batch_request_planned_failed(schema, monkeypatch):
+    calls = []
+    responses = [None, {'beans': [{
+        'name': 'java.lang:type=Memory', 'Used': 1}]}]
+
+    def make_batch_request(client, queries, paths):
+        calls.append(queries)
+        return [responses.pop(0) for query in queries]
+
+    monkeypatch.setattr(HTTPClient, 'make_batch_request', make_batch_request)
+    monkeypatch.setattr(Collector, 'planner', QueryPlanner())
+    schema.get_request_addresses.return_value = [['beans', '0', 'Used']]
+    collector = Collector('http://localhost:50070', schema)
+    requests = [{'query': '/jmx?qry=java.lang:type=Memory'}]
+    assert collector.make_batch_request(requests) == [None]
+    assert collector.make_batch_request(requests) == [{'beans': [{
+        'name': 'java.lang:type=Memory', 'Used': 1}]}]
+    assert calls == [['/jmx?get=java.lang:type=Memory::Used'],
+                     ['/jmx?get=java.lang:type=Memory::Used']]
+
+
+def test_make_batch_request_coalesced(schema, monkeypatch):
+    calls = []
+    first = {'name': 'Hadoop:service=NameNode,name=FSNamesystem'}
+    second = {'name': 'Hadoop:service=NameNode,name=NameNodeInfo'}
+
+    def make_batch_request(client, queries, paths):
+        calls.append((queries, paths))
+        return [{'beans': [first, second]} for query in queries]
+
+    monkeypatch.setattr(HTTPClient, 'make_batch_request', make_batch_request)
+    monkeypatch.setattr(Collector, 'coalescer', QueryCoalescer())
+    schema.get_request_paths.return_value = [('beans',)]
+    collector = Collector('http://localhost:50070', schema)
+    requests = [
+        {'query': '/jmx?qry=Hadoop:service=NameNode,name=FSNamesystem'},
+        {'query': '/ws/v1/cluster/info'},
+        {'query': '/jmx?qry=Hadoop:service=NameNode,name=NameNodeInfo'}]
+    collector.make_batch_request(requests)
+    assert len(calls[0][0]) == 3
+    del calls[:]
+    assert collector.make_batch_request(requests) == [
+        {'beans': [first]}, {'beans': [first, second]}, {'beans': [second]}]
+    assert sorted(calls) == [
+        (['/ws/v1/cluster/info',
+          '/jmx?qry=Hadoop:service=NameNode,*'], [[('beans',)], [('beans',)]])]
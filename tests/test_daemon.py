@@ -0,0 +1,124 @@
+import pytest
+import gzip
+import mock
+import StringIO
+import threading
+import urllib2
+
+from monitoring.daemon import CollectorDaemon, CollectorLoop, SnapshotStore
+from monitoring.daemon import request_snapshot
+from monitoring.metrics import LeafMeta, Metrics
+from monitoring.snapshot import read_snapshot
+
+
+@pytest.fixture
+def formatter():
+    return mock.Mock(side_effect=lambda m, p, f: '%s %s %s' % (
+        sorted(m.keys()), p, f))
+
+
+@pytest.fixture
+def store(formatter):
+    return SnapshotStore(formatter)
+
+
+@pytest.fixture
+def daemon(tmpdir, request):
+    service = mock.Mock()
+    service.collect.return_value = {'unit.test': {'value': 1}}
+    service.output.side_effect = lambda m, p, f: 'unitTest = 1'
+    loop = CollectorLoop(service, '1', 'unit')
+    result = CollectorDaemon(loop, str(tmpdir.join('unittest.sock')),
+                             http_address=('127.0.0.1', 0))
+    request.addfinalizer(result.server.server_close)
+    request.addfinalizer(result.exposition.server_close)
+    return result
+
+
+def test_store_empty(store):
+    assert store.output('subagent') is None
+
+
+def test_store_output(store, formatter):
+    store.update({'unit.test': {}})
+    assert store.output('subagent') == "['unit.test'] None subagent"
+    assert store.output('subagent') == "['unit.test'] None subagent"
+    assert store.output('human', 'unit.*') == "['unit.test'] unit.* human"
+    assert len(formatter.mock_calls) == 2
+
+
+def test_store_update(store, formatter):
+    store.update({'unit.test': {}})
+    store.output('subagent')
+    store.update({'unit.other': {}})
+    assert store.output('subagent') == "['unit.other'] None subagent"
+
+
+def test_store_output_gzip(store, formatter):
+    assert store.output_gzip('prometheus') is None
+    store.update({'unit.test': {}})
+    output = store.output_gzip('prometheus')
+    assert store.output_gzip('prometheus') is output
+    assert gzip.GzipFile(fileobj=StringIO.StringIO(output)).read() == \
+        "['unit.test'] None prometheus"
+    assert len(formatter.mock_calls) == 1
+
+
+def test_collect(daemon):
+    daemon.loop.collect()
+    assert daemon.loop.service.collect.mock_calls == [mock.call('1', 'unit')]
+    assert daemon.store.output('subagent') == 'unitTest = 1'
+
+
+def test_collect_snapshot_file(tmpdir):
+    metrics = Metrics()
+    metrics.add(LeafMeta('unit.test', '1.1', 'unitTest'), 1)
+    service = mock.Mock()
+    service.collect.return_value = metrics
+    loop = CollectorLoop(service, '1', 'unit')
+    path = str(tmpdir.join('unittest.snapshot'))
+    daemon = CollectorDaemon(loop, str(tmpdir.join('unittest.sock')),
+                             snapshot_file=path)
+    try:
+        daemon.loop.collect()
+    finally:
+        daemon.server.server_close()
+    assert read_snapshot(path) == 'unitTest = 1'
+
+
+def test_request_snapshot(daemon):
+    daemon.loop.collect()
+    server = threading.Thread(target=daemon.server.serve_forever)
+    server.daemon = True
+    server.start()
+    try:
+        path = daemon.server.server_address
+        assert request_snapshot(path, 'subagent') == 'unitTest = 1'
+        assert request_snapshot(path, 'unknown') == ''
+    finally:
+        daemon.server.shutdown()
+
+
+def test_exposition(daemon):
+    server = threading.Thread(target=daemon.exposition.serve_forever)
+    server.daemon = True
+    server.start()
+    url = 'http://127.0.0.1:%d' % daemon.exposition.server_address[1]
+    try:
+        with pytest.raises(urllib2.HTTPError) as error:
+            urllib2.urlopen(url + '/metrics', timeout=5)
+        assert error.value.code == 503
+        daemon.loop.collect()
+        response = urllib2.urlopen(url + '/metrics', timeout=5)
+        assert response.read() == 'unitTest = 1'
+        response = urllib2.urlopen(urllib2.Request(
+            url + '/metrics', headers={'Accept-Encoding': 'gzip'}), timeout=5)
+        assert response.info().get('Content-Encoding') == 'gzip'
+        assert gzip.GzipFile(
+            fileobj=StringIO.StringIO(response.read())).read() == \
+            'unitTest = 1'
+        with pytest.raises(urllib2.HTTPError) as error:
+            urllib2.urlopen(url + '/other', timeout=5)
+        assert error.value.code == 404
+    finally:
+        daemon.exposition.shutdown()
@@ -0,0 +1,101 @@
+import pytest
+import threading
+import time
+
+from monitoring.executor import Deadline, WorkerPool
+
+
+@pytest.fixture
+def pool():
+    return WorkerPool(4, {'limited': 1})
+
+
+def test_run(pool):
+    tasks = [(x, 'http', lambda x=x: x * 2) for x in range(10)]
+    assert dict(pool.run(tasks)) == dict((x, x * 2) for x in range(10))
+
+
+def test_run_empty(pool):
+    assert list(pool.run([])) == []
+
+
+def test_run_failed_task(pool):
+    def fail():
+        raise RuntimeError('unittest')
+
+    tasks = [('ok', 'http', lambda: 1), ('fail', 'http', fail)]
+    assert list(pool.run(tasks)) == [('ok', 1)]
+
+
+def test_run_concurrently(pool):
+    def task():
+        time.sleep(0.2)
+        return True
+
+    started = time.time()
+    tasks = [(x, 'http', task) for x in range(4)]
+    assert len(list(pool.run(tasks))) == 4
+    assert time.time() - started < 0.6
+
+
+def test_run_group_limit(pool):
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def task():
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+
+    tasks = [(x, 'limited', task) for x in range(4)]
+    assert len(list(pool.run(tasks))) == 4
+    assert active[1] == 1
+
+
+def test_run_group_limit_other_groups():
+    pool = WorkerPool(2, {'limited': 1})
+
+    def task():
+        time.sleep(0.2)
+        return True
+
+    tasks = [('a', 'limited', task), ('b', 'limited', task),
+             ('c', 'other', lambda: True)]
+    started = time.time()
+    results = pool.run(tasks)
+    assert next(results) == ('c', True)
+    assert time.time() - started < 0.15
+    assert sorted(results) == [('a', True), ('b', True)]
+
+
+def test_run_timeout_releases_group(pool):
+    tasks = [(x, 'limited', lambda: time.sleep(0.2)) for x in range(3)]
+    assert list(pool.run(tasks, 0.1)) == []
+    time.sleep(0.3)
+    assert list(pool.run([('x', 'limited', lambda: 1)], 1)) == [('x', 1)]
+
+
+def test_deadline():
+    deadline = Deadline(10, grace=1)
+    assert 8.5 < deadline.remaining() <= 9
+    assert not deadline.expired()
+    assert deadline.budget(3) == 3
+    assert 8.5 < deadline.budget(None) <= 9
+
+
+def test_deadline_expired():
+    deadline = Deadline(0.5, grace=1)
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+    assert deadline.budget(3) == 0
+
+
+def test_deadline_unlimited():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.budget(3) == 3
+    assert deadline.budget(None) is None
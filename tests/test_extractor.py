@@ -0,0 +1,58 @@
+import pytest
+import StringIO
+
+from monitoring.extractor import extract, minimize_paths
+
+
+@pytest.fixture
+def document():
+    return StringIO.StringIO("""
+{
+  "clusterMetrics": {
+    "appsCompleted": 10,
+    "allocatedMB": 1.5,
+    "nested": {"list": [1, {"key": "value"}]}
+  },
+  "beans": [{"name": "first"}, {"name": "second"}],
+  "other": "value"
+}
+""")
+
+
+FIXTURES = [
+    ([('clusterMetrics', 'appsCompleted')],
+     {'clusterMetrics': {'appsCompleted': 10}}),
+    ([('clusterMetrics', 'allocatedMB'), ('beans',)],
+     {'clusterMetrics': {'allocatedMB': 1.5},
+      'beans': [{'name': 'first'}, {'name': 'second'}]}),
+    ([('clusterMetrics', 'nested')],
+     {'clusterMetrics': {'nested': {'list': [1, {'key': 'value'}]}}}),
+    ([('unknown',)], {}),
+    ([('beans', 'name')], {}),
+]
+
+
+@pytest.mark.parametrize('paths, expected', FIXTURES)
+def test_extract(document, paths, expected):
+    assert extract(document, paths) == expected
+
+
+def test_extract_stops_early():
+    stream = StringIO.StringIO('{"first": 1, "second": [1, 2] ' + ' ' * 4096)
+    stream.read = lambda size=-1, read=stream.read: read(min(size, 8))
+    assert extract(stream, [('first',)]) == {'first': 1}
+    assert stream.tell() < 4096
+
+
+FIXTURES = [
+    (None, None),
+    ([], []),
+    ([('a', 'b'), ('a',), ('c',)], [('a',), ('c',)]),
+    ([('a', 'b'), ('a', 'c'), ('a', 'b')], [('a', 'b'), ('a', 'c')]),
+    ([('ab',), ('a',)], [('a',), ('ab',)]),
+]
+
+
+@pytest.mark.parametrize('paths, expected', FIXTURES)
+def test_minimize_paths(paths, expected):
+    assert minimize_paths(paths) == expected
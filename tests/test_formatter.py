@@ -0,0 +1,135 @@
+import pytest
+import json
+import os
+import StringIO
+
+from monitoring.formatter import JSONOutputFormatter, MIBOutputFormatter
+from monitoring.formatter import PrometheusOutputFormatter
+from monitoring.metrics import LeafMeta, Metrics
+from monitoring.service import CollectorService, MIBGeneratorService
+
+
+@pytest.fixture
+def metrics():
+    result = Metrics()
+    result.add(LeafMeta('h.a.y', 'h.1.2', 'hAY', 'Counter64'), 1)
+    result.add(LeafMeta('h.a.x', 'h.1.1', 'hAX', 'INTEGER'), 2)
+    result.add(LeafMeta('h.b', 'h.2', 'hB'), 3)
+    return result
+
+
+@pytest.fixture
+def templates(tmpdir):
+    directory = tmpdir.join('templates')
+    directory.join('names.txt').write(
+        '{% for key, value in objects.items() %}'
+        '{{ key[1] }} {{ value.oid }}\n{% endfor %}', ensure=True)
+    return str(directory)
+
+
+def test_format(metrics, templates):
+    formatter = MIBOutputFormatter(templates)
+    assert formatter.format(metrics).items() == [
+        (('h', 'hA'), {'oid': '1'}),
+        (('hA', 'hAX'), {
+            'name': 'h.a.x', 'oid': '1', 'snmp': 'hAX', 'type': 'INTEGER',
+            'unit': '', 'description': None}),
+        (('hA', 'hAY'), {
+            'name': 'h.a.y', 'oid': '2', 'snmp': 'hAY', 'type': 'Counter64',
+            'unit': '', 'description': None}),
+        (('h', 'hB'), {
+            'name': 'h.b', 'oid': '2', 'snmp': 'hB', 'type': 'OCTET STRING',
+            'unit': '', 'description': None}),
+    ]
+
+
+def test_output(metrics, templates, tmpdir):
+    output = tmpdir.join('output')
+    output.join('other.txt').write('keep', ensure=True)
+    formatter = MIBOutputFormatter(templates)
+    assert formatter.output(metrics, str(output)) == ['names.txt']
+    assert output.join('names.txt').read() == 'hA 1\nhAX 1\nhAY 2\nhB 2\n'
+    assert output.join('other.txt').read() == 'keep'
+
+
+def test_update(metrics, templates, tmpdir, monkeypatch):
+    monkeypatch.setattr(MIBGeneratorService, 'generate',
+                        lambda self, oid, name: metrics)
+    service = MIBGeneratorService(templates)
+    output = str(tmpdir.join('output'))
+    assert service.update(output, '1', 'hadoop') is True
+    assert service.update(output, '1', 'hadoop') is False
+    assert service.update(output, '2', 'hadoop') is True
+    assert service.update(output, '2', 'hadoop', force=True) is True
+
+    os.unlink(os.path.join(output, 'names.txt'))
+    assert service.update(output, '2', 'hadoop') is True
+
+    tmpdir.join('templates', 'names.txt').rename(
+        tmpdir.join('templates', 'renamed.txt'))
+    assert service.update(output, '2', 'hadoop') is True
+    assert sorted(os.listdir(output)) == ['.generated', 'renamed.txt']
+
+
+def test_prometheus_output():
+    metrics = Metrics()
+    metrics.add(LeafMeta('h.a.bytes', 'h.1.1', 'hABytes', 'Gauge32',
+                         'bytes', 'Used "space"'), 10)
+    metrics.add(LeafMeta('h.a.ops', 'h.1.2', 'hAOps', 'Counter64'), 2.5)
+    metrics.add(LeafMeta('h.q.apps.b', 'h.2.1.b', 'hQAppsB', 'Gauge32',
+                         'apps', index='b'), 1)
+    metrics.add(LeafMeta('h.q.apps.a', 'h.2.1.a', 'hQAppsA', 'Gauge32',
+                         'apps', index='a'), 3)
+    metrics.add(LeafMeta('h.state', 'h.3', 'hState'), 'active')
+    metrics.add(LeafMeta('h.timeout', 'h.4', 'hTimeout'), None, timeout=True)
+    assert PrometheusOutputFormatter().output(metrics, '*') == (
+        '# HELP h_a_bytes Used "space"\n'
+        '# TYPE h_a_bytes gauge\n'
+        'h_a_bytes 10\n'
+        '# TYPE h_a_ops_total counter\n'
+        'h_a_ops_total 2.5\n'
+        '# TYPE h_q_apps gauge\n'
+        'h_q_apps{index="a"} 3\n'
+        'h_q_apps{index="b"} 1\n')
+
+
+def test_prometheus_pattern(metrics):
+    assert PrometheusOutputFormatter().output(metrics, 'h.a.*') == (
+        '# TYPE h_a_x gauge\n'
+        'h_a_x 2\n'
+        '# TYPE h_a_y_total counter\n'
+        'h_a_y_total 1\n')
+
+
+def test_json_output(metrics):
+    metrics.add(LeafMeta('h.c', 'h.3', 'hC'), None, timeout=True)
+    lines = JSONOutputFormatter().output(metrics, 'h.*').split('\n')
+    leaves = [json.loads(x) for x in lines]
+    assert [x['name'] for x in leaves] == ['h.a.x', 'h.a.y', 'h.b', 'h.c']
+    assert leaves[0] == {
+        'name': 'h.a.x', 'oid': 'h.1.1', 'snmp': 'hAX', 'type': 'INTEGER',
+        'unit': '', 'value': 2, 'timestamp': leaves[0]['timestamp']}
+    assert leaves[3]['timeout'] is True
+
+
+def test_json_write(metrics):
+    stream = StringIO.StringIO()
+    JSONOutputFormatter().write(stream, metrics, 'h.a.*', 1.5)
+    assert stream.getvalue() == (
+        '{"name":"h.a.x","oid":"h.1.1","snmp":"hAX","timestamp":1.5,'
+        '"type":"INTEGER","unit":"","value":2}\n'
+        '{"name":"h.a.y","oid":"h.1.2","snmp":"hAY","timestamp":1.5,'
+        '"type":"Counter64","unit":"","value":1}\n')
+
+
+def test_collect_sink(metrics, monkeypatch):
+    other = Metrics()
+    other.add(LeafMeta('h.c', 'h.3', 'hC'), 4)
+    monkeypatch.setattr(
+        CollectorService, 'get_tasks', lambda self, *args: [
+            ('a', 'http', lambda: metrics), ('b', 'http', lambda: other)])
+    results = []
+    service = CollectorService('localhost')
+    collected = service.collect('h', 'h', sink=results.append)
+    assert set(results) == set([metrics, other])
+    assert sorted(collected.keys()) == ['h.a.x', 'h.a.y', 'h.b', 'h.c']
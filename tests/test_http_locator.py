@@ -1,5 +1,6 @@
 import pytest
 import mock
+import socket
 
 from collections import namedtuple
 
@@ -40,13 +41,54 @@ FIXTURES = [
 @pytest.mark.parametrize('code, result', FIXTURES)
 def test_exists(locator, monkeypatch, code, result):
     if code is None:
-        def head(url):
+        def head(url, **kwargs):
             raise requests.exceptions.ConnectionError('error')
     else:
-        def head(url):
+        def head(url, **kwargs):
             response = namedtuple('Response', ('status_code',))
             return response(status_code=code)
 
     monkeypatch.setattr(requests, 'head', head)
 
     assert locator.exists() == result
+
+
+def test_exists_timeout(monkeypatch):
+    locator = HttpServiceLocator(connect_timeout=0.5, read_timeout=1)
+
+    def head(url, timeout=None):
+        assert timeout == (0.5, 1.0)
+        raise requests.exceptions.ReadTimeout('timeout')
+
+    monkeypatch.setattr(requests, 'head', head)
+
+    assert locator.exists() is False
+
+
+def test_revalidate(locator, monkeypatch):
+    connection = mock.Mock()
+    calls = []
+
+    def create_connection(address, timeout):
+        calls.append((address, timeout))
+        return connection
+
+    monkeypatch.setattr(socket, 'create_connection', create_connection)
+    assert locator.revalidate() is True
+    assert calls == [(('localhost', 80), 1.0)]
+    assert connection.close.mock_calls == [mock.call()]
+
+
+def test_revalidate_closed(locator, monkeypatch):
+    def create_connection(address, timeout):
+        raise socket.error(111, 'Connection refused')
+
+    monkeypatch.setattr(socket, 'create_connection', create_connection)
+    assert locator.revalidate() is False
+
+
+def test_may_exist(locator, monkeypatch):
+    monkeypatch.setattr(locator, 'revalidate', lambda: False)
+    assert locator.may_exist() is False
+    monkeypatch.setattr(locator, 'revalidate', lambda: True)
+    assert locator.may_exist() is True
@@ -1,9 +1,12 @@
 import pytest
 import mock
+import os
 import subprocess
+import time
 
 
-from monitoring.collector import Client, JMXClient
+from monitoring.collector import Client, JMXClient, JMXSession, JMXSessionPool
+from monitoring.executor import Deadline, TIMED_OUT
 
 
 @pytest.fixture
@@ -91,6 +94,25 @@ def test_run_command_fail(client, monkeypatch):
     assert proc.stdin.write.mock_calls == [mock.call(data)]
 
 
+def test_run_command_timeout(monkeypatch):
+    client = JMXClient('process://unittest@1111', Deadline(0.6, grace=0.5))
+    proc = mock.Mock()
+    proc.returncode = -15
+    proc.communicate.side_effect = lambda: time.sleep(0.2) or ['', '']
+    monkeypatch.setattr(subprocess, 'Popen', lambda command, **k: proc)
+    assert client.run_command(client.get_command(), 'data') is TIMED_OUT
+    assert proc.terminate.mock_calls == [mock.call()]
+
+
+def test_execute_deadline(monkeypatch):
+    client = JMXClient('process://unittest@1111', Deadline(0))
+    monkeypatch.setattr(JMXClient, 'run_command', mock.Mock())
+    assert client.make_request({'bean': 'a', 'attr': 'b'}) is TIMED_OUT
+    assert client.make_batch_request([{'bean': 'a', 'attr': 'b'}] * 2) == [
+        TIMED_OUT, TIMED_OUT]
+    assert JMXClient.run_command.mock_calls == []
+
+
 def test_make_request(client, monkeypatch):
     data = """
 {
@@ -122,3 +144,183 @@ def test_make_request_failed(client, monkeypatch):
 
     assert client.make_request(
         {'bean': 'java.lang:type=Memory', 'attr': 'HeapMemoryUsage'}) is None
+
+
+FAKE_JMXTERM = """
+while read line; do
+  case "$line" in
+    *SpecificationName*) echo 'Java Management Extensions';;
+    *NonHeapMemoryUsage*) echo '{ "used" = 20; }';;
+    *) echo '{ "used" = 10; }';;
+  esac
+done
+"""
+
+
+@pytest.fixture
+def session(monkeypatch, request):
+    result = JMXSession('unittest', os.getpid(), timeout=5)
+    monkeypatch.setattr(result, 'get_command', lambda: FAKE_JMXTERM)
+    request.addfinalizer(result.stop)
+    return result
+
+
+def test_session_command():
+    session = JMXSession('unittest', 1111)
+    assert session.get_command() == \
+        'sudo -u unittest /usr/bin/jmxterm -l 1111 -n -v silent'
+
+
+def test_session_execute(session):
+    data = 'get -b java.lang:type=Memory -s -q HeapMemoryUsage\n'
+    assert session.execute(data) == '{ "used" = 10; }\n'
+    proc = session.proc
+    assert session.execute(data + data) == '{ "used" = 10; }\n' * 2
+    assert session.proc is proc
+    assert session.check() is True
+
+
+def test_session_restart(session):
+    assert session.check() is True
+    session.proc.kill()
+    session.proc.wait()
+    assert session.execute('get\n') == '{ "used" = 10; }\n'
+
+
+def test_session_timeout(session, monkeypatch):
+    monkeypatch.setattr(session, 'get_command', lambda: 'sleep 10')
+    session.timeout = 0.1
+    assert session.execute('get\n') is None
+    assert session.proc is None
+
+
+def test_session_pool_get():
+    pool = JMXSessionPool()
+    session = pool.get('unittest', os.getpid())
+    assert pool.get('unittest', os.getpid()) is session
+    assert pool.get('other', os.getpid()) is not session
+
+
+def test_session_pool_evict(monkeypatch):
+    pool = JMXSessionPool(idle_timeout=60)
+    session = pool.get('unittest', os.getpid())
+    monkeypatch.setattr(pool, 'pid_exists', lambda pid: False)
+    assert pool.get('unittest', os.getpid()) is not session
+
+
+def test_session_pool_evict_idle():
+    pool = JMXSessionPool(idle_timeout=60)
+    session = pool.get('unittest', os.getpid())
+    session.last_used -= 120
+    assert pool.get('unittest', os.getpid()) is not session
+
+
+def test_session_pool_check_idle(session):
+    pool = JMXSessionPool(check_interval=60)
+    pool.sessions[('unittest', os.getpid())] = session
+    session.start()
+    checks = []
+    session.check = lambda: checks.append(True) or False
+    assert pool.get('unittest', os.getpid()) is session
+    assert checks == []
+    session.last_used -= 120
+    assert pool.get('unittest', os.getpid()) is session
+    assert checks == [True]
+    assert session.proc is None
+
+
+def test_session_pool_check(session):
+    pool = JMXSessionPool()
+    pool.sessions[('unittest', os.getpid())] = session
+    session.start()
+    pool.check()
+    assert session.is_alive()
+    session.check = lambda: False
+    pool.check()
+    assert session.proc is None
+
+
+def test_make_request_session(client, monkeypatch):
+    session = mock.Mock()
+    session.execute.return_value = '"used" = 10;'
+    sessions = mock.Mock()
+    sessions.get.return_value = session
+    monkeypatch.setattr(JMXClient, 'sessions', sessions)
+
+    assert client.make_request(
+        {'bean': 'java.lang:type=Memory', 'attr': 'HeapMemoryUsage'}) == {
+        'used': 10}
+    assert sessions.get.call_args_list == [mock.call('unittest', 1111)]
+
+
+def test_make_batch_request(client, monkeypatch):
+    data = """
+{
+  "used" = 10;
+}
+Java Management Extensions
+{
+  "used" = 20;
+}
+"""
+    proc = mock.Mock()
+    proc.returncode = 0
+    proc.communicate.return_value = [data, '']
+    monkeypatch.setattr(subprocess, 'Popen', lambda *a, **k: proc)
+
+    queries = [{'bean': 'java.lang:type=Memory', 'attr': 'HeapMemoryUsage'},
+               {'bean': 'java.lang:type=Memory', 'attr': 'NonHeapMemoryUsage'}]
+    assert client.make_batch_request(queries) == [{'used': 10}, {'used': 20}]
+    assert proc.stdin.write.mock_calls == [mock.call(
+        'get -b java.lang:type=Memory -s -q HeapMemoryUsage\n' +
+        JMXSession.separator +
+        'get -b java.lang:type=Memory -s -q NonHeapMemoryUsage\n')]
+
+
+def test_make_batch_request_session(client, session, monkeypatch):
+    pool = JMXSessionPool()
+    pool.sessions[('unittest', 1111)] = session
+    monkeypatch.setattr(pool, 'pid_exists', lambda pid: True)
+    monkeypatch.setattr(JMXClient, 'sessions', pool)
+
+    heap = {'bean': 'java.lang:type=Memory', 'attr': 'HeapMemoryUsage'}
+    non_heap = {'bean': 'java.lang:type=Memory',
+                'attr': 'NonHeapMemoryUsage'}
+    assert client.make_batch_request([heap, non_heap]) == [
+        {'used': 10}, {'used': 20}]
+    assert client.make_request(heap) == {'used': 10}
+    assert client.make_request(non_heap) == {'used': 20}
+    assert session.buffer == ''
+
+
+def test_make_batch_request_session_reset(client, session, monkeypatch,
+                                          request):
+    pool = JMXSessionPool()
+    request.addfinalizer(pool.close)
+    pool.sessions[('unittest', 1111)] = session
+    monkeypatch.setattr(pool, 'pid_exists', lambda pid: True)
+    monkeypatch.setattr(JMXClient, 'sessions', pool)
+    monkeypatch.setattr(JMXSession, 'get_command', lambda self: FAKE_JMXTERM)
+    monkeypatch.setattr(client, 'split_output', lambda output: [output])
+    session.start()
+
+    heap = {'bean': 'java.lang:type=Memory', 'attr': 'HeapMemoryUsage'}
+    non_heap = {'bean': 'java.lang:type=Memory',
+                'attr': 'NonHeapMemoryUsage'}
+    assert client.make_batch_request([heap, non_heap]) == [
+        {'used': 10}, {'used': 20}]
+    assert session.proc is None
+    assert pool.sessions[('unittest', 1111)] is not session
+
+
+def test_make_batch_request_failed(client, monkeypatch):
+    proc = mock.Mock()
+    proc.returncode = 1
+    proc.communicate.return_value = ['', 'ERROR']
+    popen = mock.Mock(return_value=proc)
+    monkeypatch.setattr(subprocess, 'Popen', popen)
+
+    queries = [{'bean': 'java.lang:type=Memory', 'attr': 'HeapMemoryUsage'},
+               {'bean': 'java.lang:type=Memory', 'attr': 'NonHeapMemoryUsage'}]
+    assert client.make_batch_request(queries) == [None, None]
+    assert len(popen.mock_calls) == 3
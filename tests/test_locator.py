@@ -1,9 +1,11 @@
 import pytest
 import mock
 import os
+import time
 
 
 from monitoring.locator import ServiceLocator, Locator, DummyLocator
+from monitoring.locator import DiscoveryCache
 
 
 @pytest.fixture
@@ -91,3 +93,78 @@ def test_load_config(service_locator, locator_config):
         'unittest'].kwargs == {}
     assert service_locator.locators[
         'unittest-argument'].kwargs == {'key': 'value'}
+
+
+def test_exists_timeout(service_locator, dummy_locator, monkeypatch):
+    slow_locator = DummyLocator()
+    monkeypatch.setattr(slow_locator, 'exists', lambda: time.sleep(1))
+    service_locator.add('unittest', dummy_locator)
+    service_locator.add('unittest-slow', slow_locator)
+    assert set(service_locator.exists(0.2)) == set(['unittest'])
+
+
+@pytest.fixture
+def discovery_cache(tmpdir):
+    return DiscoveryCache(str(tmpdir.join('cache', 'discovery.json')), 60)
+
+
+def test_discovery_cache(discovery_cache):
+    assert discovery_cache.load() == {}
+    now = time.time()
+    discovery_cache.save({
+        'fresh': {'time': now, 'found': True},
+        'expired': {'time': now - 120, 'found': True},
+    })
+    assert discovery_cache.load() == {'fresh': {'time': now, 'found': True}}
+
+
+def test_discovery_cache_broken(discovery_cache, tmpdir):
+    tmpdir.join('cache', 'discovery.json').write('{', ensure=True)
+    assert discovery_cache.load() == {}
+
+
+def test_exists_cached(service_locator, dummy_locator, discovery_cache,
+                       monkeypatch):
+    service_locator.add('unittest', dummy_locator)
+    service_locator.cache = discovery_cache
+    assert list(service_locator.exists()) == ['unittest']
+    entry = discovery_cache.load()['unittest']
+    assert entry['found'] is True
+    assert entry['locator'] == 'DummyLocator'
+
+    monkeypatch.setattr(dummy_locator, 'revalidate', lambda: True)
+    monkeypatch.setattr(dummy_locator, 'exists', mock.Mock())
+    assert list(service_locator.exists()) == ['unittest']
+    assert dummy_locator.exists.mock_calls == []
+    assert discovery_cache.load()['unittest'] == entry
+
+
+def test_exists_cached_closed(service_locator, dummy_locator,
+                              discovery_cache):
+    service_locator.add('unittest', dummy_locator)
+    service_locator.cache = discovery_cache
+    names = service_locator.exists()
+    assert next(names) == 'unittest'
+    names.close()
+    assert discovery_cache.load()['unittest']['found'] is True
+
+
+def test_locate(service_locator, dummy_locator, monkeypatch):
+    entry = {'time': 1, 'locator': 'DummyLocator', 'found': True, 'state': {}}
+    monkeypatch.setattr(dummy_locator, 'revalidate', lambda: False)
+    dummy_locator.is_exist = False
+    found, result = service_locator.locate(dummy_locator, entry)
+    assert found is False
+    assert result['found'] is False and result['time'] > 1
+
+    entry = {'time': 1, 'locator': 'DummyLocator', 'found': False}
+    dummy_locator.is_exist = True
+    monkeypatch.setattr(dummy_locator, 'may_exist', lambda: False)
+    assert service_locator.locate(dummy_locator, entry) == (False, entry)
+    monkeypatch.setattr(dummy_locator, 'may_exist', lambda: True)
+    found, result = service_locator.locate(dummy_locator, entry)
+    assert found is True
+    assert result['found'] is True and result['time'] > 1
+
+    entry = {'time': 1, 'locator': 'OtherLocator', 'found': False}
+    assert service_locator.locate(dummy_locator, entry)[0] is True
@@ -0,0 +1,131 @@
+import pytest
+
+from monitoring.metrics import LeafMeta, Metrics
+
+
+@pytest.fixture
+def meta():
+    return LeafMeta('unit.test.used', '1.1', 'unitTestUsed', 'Counter64',
+                    'bytes', 'used memory')
+
+
+@pytest.fixture
+def metrics(meta):
+    result = Metrics()
+    result.add(meta, 100)
+    result.add(LeafMeta('unit.test.name', '1.2', 'unitTestName'), None,
+               timeout=True)
+    return result
+
+
+def test_add(metrics, meta):
+    assert len(metrics) == 2
+    assert 'unit.test.used' in metrics
+    assert sorted(metrics.keys()) == ['unit.test.name', 'unit.test.used']
+    assert metrics.get_meta('unit.test.used') is meta
+    assert metrics.get_value('unit.test.used') == 100
+    assert metrics.is_timeout('unit.test.name')
+    assert not metrics.is_timeout('unit.test.used')
+    assert metrics.count_timeouts() == 1
+
+
+def test_add_replace(metrics, meta):
+    metrics.set_rate('unit.test.used', 1.5)
+    metrics.add(meta, 200)
+    assert len(metrics) == 2
+    assert metrics.get_value('unit.test.used') == 200
+    assert metrics.get_rate('unit.test.used') is None
+
+
+def test_update(metrics, meta):
+    metrics.set_rate('unit.test.used', 1.5)
+    result = Metrics()
+    result.add(meta, 10)
+    result.update(metrics)
+    assert result.as_dict() == metrics.as_dict()
+
+
+def test_as_dict(metrics):
+    metrics.set_rate('unit.test.used', 1.5)
+    assert metrics.as_dict() == {
+        'unit.test.used': {
+            'name': 'unit.test.used',
+            'oid': '1.1',
+            'snmp': 'unitTestUsed',
+            'type': 'Counter64',
+            'unit': 'bytes',
+            'description': 'used memory',
+            'value': 100,
+            'rate': 1.5,
+        },
+        'unit.test.name': {
+            'name': 'unit.test.name',
+            'oid': '1.2',
+            'snmp': 'unitTestName',
+            'type': 'OCTET STRING',
+            'unit': '',
+            'description': None,
+            'value': None,
+            'timeout': True,
+        },
+    }
+
+
+@pytest.fixture
+def index():
+    metrics = Metrics()
+    for name, oid in [('unit.memory.used', 'unit.2.1'),
+                      ('unit.memory.free', 'unit.2.2'),
+                      ('unit.table.name.10', 'unit.1.2.10'),
+                      ('unit.table.name.9', 'unit.1.2.9'),
+                      ('unit.table.index.9', 'unit.1.1.9'),
+                      ('unit.other', 'unit.10')]:
+        metrics.add(LeafMeta(name, oid, name), 1)
+    return metrics.get_index()
+
+
+def names(index, numbers):
+    return [index.metas[x].name for x in numbers]
+
+
+FIXTURES = [
+    ('*', ['unit.memory.free', 'unit.memory.used', 'unit.other',
+           'unit.table.index.9', 'unit.table.name.10', 'unit.table.name.9']),
+    ('unit.memory.*', ['unit.memory.free', 'unit.memory.used']),
+    ('unit.mem*', ['unit.memory.free', 'unit.memory.used']),
+    ('unit.table.*.9', ['unit.table.index.9', 'unit.table.name.9']),
+    ('*.name.1?', ['unit.table.name.10']),
+    ('unit.other', ['unit.other']),
+    ('unit.memory', []),
+    ('unknown.*', []),
+]
+
+
+@pytest.mark.parametrize('pattern, expected', FIXTURES)
+def test_index_glob(index, pattern, expected):
+    assert names(index, index.glob(pattern)) == expected
+
+
+def test_index_subtree(index):
+    assert names(index, index.subtree('unit.table.name')) == [
+        'unit.table.name.10', 'unit.table.name.9']
+    assert index.subtree('unit.unknown') == []
+    assert index.has_children('unit.memory')
+    assert not index.has_children('unit.other')
+    assert not index.has_children('unit.unknown')
+
+
+def test_index_oids(index):
+    assert names(index, index.oids) == [
+        'unit.table.index.9', 'unit.table.name.9', 'unit.table.name.10',
+        'unit.memory.used', 'unit.memory.free', 'unit.other']
+    assert names(index, index.oid_subtree('unit.1.2')) == [
+        'unit.table.name.9', 'unit.table.name.10']
+    assert index.oid_subtree('unit.3') == []
+
+
+def test_get_index(metrics, meta):
+    index = metrics.get_index()
+    assert metrics.get_index() is index
+    metrics.add(meta, 1)
+    assert metrics.get_index() is not index
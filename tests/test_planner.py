@@ -0,0 +1,154 @@
+import pytest
+
+from monitoring.planner import QueryCoalescer, QueryPlanner
+from monitoring.planner import match_object_name, parse_object_name
+
+
+@pytest.fixture
+def planner():
+    return QueryPlanner()
+
+
+ENDPOINT = 'http://localhost:50070'
+QUERY = '/jmx?qry=java.lang:type=Memory'
+PLANNED = '/jmx?get=java.lang:type=Memory::HeapMemoryUsage'
+
+
+FIXTURES = [
+    (QUERY, [['beans', '0', 'HeapMemoryUsage', 'used'],
+             ['beans', '0', 'HeapMemoryUsage', 'max']], PLANNED),
+    (QUERY, [['beans', '0', 'HeapMemoryUsage'],
+             ['beans', '0', 'NonHeapMemoryUsage']], QUERY),
+    (QUERY, [['beans', '0']], QUERY),
+    (QUERY, [['beans', 'filter(name, value)', 'HeapMemoryUsage']], QUERY),
+    (QUERY, [], QUERY),
+    ('/jmx?qry=Hadoop:*', [['beans', '0', 'Total']], '/jmx?qry=Hadoop:*'),
+    ('/ws/v1/cluster/info', [['beans', '0', 'Total']],
+     '/ws/v1/cluster/info'),
+    ({'bean': 'java.lang:type=Memory'}, [['beans', '0', 'Total']],
+     {'bean': 'java.lang:type=Memory'}),
+]
+
+
+@pytest.mark.parametrize('query, addresses, expected', FIXTURES)
+def test_plan(planner, query, addresses, expected):
+    assert planner.plan(ENDPOINT, query, addresses) == expected
+
+
+def test_plan_rejected(planner):
+    addresses = [['beans', '0', 'HeapMemoryUsage']]
+    planner.reject(ENDPOINT, PLANNED)
+    assert planner.plan(ENDPOINT, QUERY, addresses) == QUERY
+    assert planner.plan('http://remote:50070', QUERY, addresses) == PLANNED
+
+
+FIXTURES = [
+    ({'beans': [{'name': 'java.lang:type=Memory',
+                 'HeapMemoryUsage': {}}]}, True),
+    ({'beans': [{'name': 'java.lang:type=Memory',
+                 'HeapMemoryUsage': {}, 'result': 'ERROR'}]}, False),
+    ({'beans': [{'name': 'java.lang:type=Memory'}]}, False),
+    ({'beans': [{'name': 'java.lang:type=Threading',
+                 'HeapMemoryUsage': {}}]}, False),
+    ({'beans': []}, False),
+    ({}, False),
+    (None, False),
+]
+
+
+@pytest.mark.parametrize('response, expected', FIXTURES)
+def test_is_accepted(planner, response, expected):
+    assert planner.is_accepted(PLANNED, response) == expected
+
+
+def test_parse_object_name():
+    assert parse_object_name('Hadoop:service=NameNode,name=FSNamesystem') == \
+        parse_object_name('Hadoop:name=FSNamesystem, service=NameNode')
+
+
+FIXTURES = [
+    ('Hadoop:service=NameNode,name=FSNamesystem',
+     'Hadoop:name=FSNamesystem,service=NameNode', True),
+    ('Hadoop:service=NameNode,*',
+     'Hadoop:name=FSNamesystem,service=NameNode', True),
+    ('Hadoop:*', 'Hadoop:name=FSNamesystem,service=NameNode', True),
+    ('Hadoop:service=NameNode',
+     'Hadoop:name=FSNamesystem,service=NameNode', False),
+    ('Hadoop:service=JournalNode,name=Journal-*',
+     'Hadoop:service=JournalNode,name=Journal-ns1', True),
+    ('Hadoop:service=DataNode,*',
+     'Hadoop:name=FSNamesystem,service=NameNode', False),
+    ('java.lang:type=Memory', 'Hadoop:type=Memory', False),
+]
+
+
+@pytest.mark.parametrize('pattern, name, expected', FIXTURES)
+def test_match_object_name(pattern, name, expected):
+    assert match_object_name(pattern, name) == expected
+
+
+NAMESYSTEM = '/jmx?qry=Hadoop:service=NameNode,name=FSNamesystem'
+NAMENODE_INFO = '/jmx?qry=Hadoop:service=NameNode,name=NameNodeInfo'
+COMBINED = '/jmx?qry=Hadoop:service=NameNode,*'
+
+
+@pytest.fixture
+def coalescer():
+    return QueryCoalescer(10)
+
+
+def test_coalesce(coalescer):
+    queries = [NAMESYSTEM, QUERY, NAMENODE_INFO, PLANNED, '/ws/v1']
+    coalescer.sizes[(ENDPOINT, NAMESYSTEM)] = 5
+    coalescer.sizes[(ENDPOINT, NAMENODE_INFO)] = 5
+    assert sorted(coalescer.coalesce(ENDPOINT, queries)) == [
+        (PLANNED, [3]),
+        ('/jmx?qry=Hadoop:service=NameNode,*', [0, 2]),
+        ('/jmx?qry=java.lang:type=Memory', [1]),
+        ('/ws/v1', [4])]
+
+
+def test_coalesce_unmeasured(coalescer):
+    assert coalescer.coalesce(ENDPOINT, [NAMESYSTEM, NAMENODE_INFO]) == [
+        (NAMESYSTEM, [0]), (NAMENODE_INFO, [1])]
+    coalescer.sizes[(ENDPOINT, NAMESYSTEM)] = 5
+    assert coalescer.coalesce(ENDPOINT, [NAMESYSTEM, NAMENODE_INFO]) == [
+        (NAMESYSTEM, [0]), (NAMENODE_INFO, [1])]
+
+
+def test_coalesce_expensive(coalescer):
+    coalescer.sizes[(ENDPOINT, NAMESYSTEM)] = 5
+    coalescer.sizes[(ENDPOINT, NAMENODE_INFO)] = 5
+    coalescer.sizes[(ENDPOINT, COMBINED)] = 15
+    assert coalescer.coalesce(ENDPOINT, [NAMESYSTEM, NAMENODE_INFO]) == [
+        (COMBINED, [0, 1])]
+    coalescer.sizes[(ENDPOINT, COMBINED)] = 20
+    assert coalescer.coalesce(ENDPOINT, [NAMESYSTEM, NAMENODE_INFO]) == [
+        (NAMESYSTEM, [0]), (NAMENODE_INFO, [1])]
+
+
+def test_coalesce_wildcard(coalescer):
+    queries = ['/jmx?qry=Hadoop:service=JournalNode,name=Journal-*',
+               '/jmx?qry=Hadoop:service=JournalNode,name=JvmMetrics',
+               '/jmx?qry=*:type=Memory']
+    for query in queries:
+        coalescer.sizes[(ENDPOINT, query)] = 5
+    assert coalescer.coalesce(ENDPOINT, queries) == [
+        ('/jmx?qry=*:type=Memory', [2]),
+        ('/jmx?qry=Hadoop:service=JournalNode,*', [0, 1])]
+
+
+def test_split(coalescer):
+    first = {'name': 'Hadoop:service=NameNode,name=FSNamesystem'}
+    second = {'name': 'Hadoop:service=NameNode,name=NameNodeInfo'}
+    other = {'name': 'Hadoop:service=NameNode,name=JvmMetrics'}
+    response = {'beans': [other, second, first]}
+    assert coalescer.split([NAMESYSTEM, NAMENODE_INFO], response) == [
+        {'beans': [first]}, {'beans': [second]}]
+    assert coalescer.split([NAMESYSTEM, NAMENODE_INFO], None) == [None, None]
+
+
+def test_record(coalescer):
+    coalescer.record(ENDPOINT, QUERY, {'beans': [{'a': 1}, {'b': 'x' * 50}]})
+    coalescer.record(ENDPOINT, NAMESYSTEM, None)
+    assert coalescer.sizes == {(ENDPOINT, QUERY): 68}
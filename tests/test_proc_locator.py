@@ -1,11 +1,12 @@
 import pytest
 import mock
+import os
 
 import psutil
 
 from collections import namedtuple
 
-from monitoring.locator import ProcessLocator
+from monitoring.locator import ProcessLocator, ProcessScanner
 
 
 @pytest.fixture
@@ -19,16 +20,32 @@ def processes():
 
 
 @pytest.fixture
-def locator():
+def locator(monkeypatch, request):
+    monkeypatch.setattr(ProcessScanner, 'proc_dir', '/nonexistent')
+    ProcessLocator.reset()
+    request.addfinalizer(ProcessLocator.reset)
     return ProcessLocator()
 
 
+@pytest.fixture
+def proc_dir(tmpdir):
+    for pid, cmdline in [
+            ('1', 'init\0'),
+            ('10', 'java\0-jar\0unittest.jar\0'),
+            ('20', 'python\0-m\0java\0'),
+            ('30', 'java\0-cp\0hadoop.jar\0'),
+            ('self', 'java\0')]:
+        tmpdir.join(pid, 'cmdline').write(cmdline, ensure=True)
+    tmpdir.join('40').ensure(dir=True)
+    tmpdir.join('version').write('Linux')
+    return str(tmpdir)
+
+
 def test_get_processes(locator, processes, monkeypatch):
     monkeypatch.setattr(psutil, 'process_iter', lambda: processes)
 
     assert locator.get_processes() == [
         ('java -jar unittest.jar', 10, 'unittest'),
-        ('python -m module arg two', 20, 'unittest')
     ]
 
 
@@ -57,3 +74,64 @@ def test_endpoint(locator):
     locator.user = 'unittest'
 
     assert locator.endpoint() == 'process://unittest@10'
+
+
+def test_get_processes_patterns(locator, processes, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        psutil, 'process_iter', lambda: calls.append(1) or processes)
+    ProcessLocator.reset(set(['.*unittest.jar$', '.*hadoop.jar$']))
+    locator.pattern = '.*unittest.jar$'
+    assert locator.exists() is True
+    locator.pattern = '.*hadoop.jar$'
+    assert locator.exists() is False
+    assert len(calls) == 1
+    locator.pattern = '.*other.jar$'
+    assert locator.exists() is False
+    assert len(calls) == 2
+
+
+def test_scan_proc(proc_dir, monkeypatch):
+    monkeypatch.setattr(ProcessScanner, 'proc_dir', proc_dir)
+    monkeypatch.setattr(ProcessScanner, 'get_username', lambda s, uid: 'user')
+    scanner = ProcessScanner(['.*unittest.jar$', '^init'])
+    assert scanner.scan() == [('java -jar unittest.jar', 10, 'user')]
+    scanner = ProcessScanner(['.*'])
+    assert scanner.scan() == [('java -jar unittest.jar', 10, 'user'),
+                              ('python -m java', 20, 'user'),
+                              ('java -cp hadoop.jar', 30, 'user')]
+
+
+def test_scan_proc_username(proc_dir, monkeypatch):
+    monkeypatch.setattr(ProcessScanner, 'proc_dir', proc_dir)
+    scanner = ProcessScanner(['.*unittest.jar$'])
+    assert scanner.scan()[0][2] == scanner.get_username(os.getuid())
+    assert scanner.get_username(2 ** 31) == str(2 ** 31)
+
+
+def test_get_start_time(tmpdir, monkeypatch):
+    monkeypatch.setattr(ProcessScanner, 'proc_dir', str(tmpdir))
+    tmpdir.join('10', 'stat').write(
+        '10 (java (1)) S 1 10 10 0 -1 4202496 1 0 0 0 0 0 0 0 20 0 1 0 '
+        '12345 1000 10 18446744073709551615', ensure=True)
+    assert ProcessScanner.get_start_time(10) == 12345
+    assert ProcessScanner.get_start_time(20) is None
+
+
+def test_revalidate(locator, monkeypatch):
+    start_times = {10: 12345}
+    monkeypatch.setattr(ProcessScanner, 'get_start_time',
+                        classmethod(lambda cls, pid: start_times.get(pid)))
+    locator.pid = 10
+    locator.user = 'unittest'
+    state = locator.get_state()
+    assert state == {'pid': 10, 'user': 'unittest', 'start_time': 12345}
+
+    locator = ProcessLocator()
+    locator.restore(state)
+    assert locator.endpoint() == 'process://unittest@10'
+    assert locator.revalidate() is True
+    start_times[10] = 23456
+    assert locator.revalidate() is False
+    locator.restore({'pid': 10, 'user': 'unittest', 'start_time': None})
+    assert locator.revalidate() is False
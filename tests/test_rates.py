@@ -0,0 +1,60 @@
+import pytest
+
+from monitoring.metrics import LeafMeta, Metrics
+from monitoring.rates import RateStore
+
+
+@pytest.fixture
+def store(tmpdir):
+    return RateStore(str(tmpdir.join('cache', 'rates.bin')), max_age=100)
+
+
+def make_metrics(**values):
+    types = {'c32': 'Counter32', 'c64': 'Counter64', 'gauge': 'Gauge32'}
+    metrics = Metrics()
+    for name, value in values.items():
+        metrics.add(LeafMeta(name, '1', name, types[name]), value)
+    return metrics
+
+
+def test_update_first(store):
+    metrics = store.update(make_metrics(c32=10, c64=10, gauge=10), 1000)
+    assert metrics.rates == {}
+    assert store.read() == {'c32': (1000, 10), 'c64': (1000, 10)}
+
+
+def test_update(store):
+    store.update(make_metrics(c32=10, c64=10, gauge=10), 1000)
+    metrics = store.update(make_metrics(c32=30, c64=110, gauge=5), 1010)
+    assert metrics.get_rate('c32') == 2.0
+    assert metrics.get_rate('c64') == 10.0
+    assert metrics.get_rate('gauge') is None
+
+
+def test_update_wrap_and_reset(store):
+    store.update(make_metrics(c32=2 ** 32 - 10, c64=1000), 1000)
+    metrics = store.update(make_metrics(c32=10, c64=20), 1010)
+    assert metrics.get_rate('c32') == 2.0
+    assert metrics.get_rate('c64') == 2.0
+
+
+def test_update_missing(store):
+    store.update(make_metrics(c32=10, c64=10), 1000)
+    metrics = store.update(make_metrics(c32=None, c64=20), 1010)
+    assert metrics.get_rate('c32') is None
+    metrics = store.update(make_metrics(c32=40, c64=30), 1020)
+    assert metrics.get_rate('c32') == 1.5
+    store.update(make_metrics(c64=40), 1200)
+    assert store.read() == {'c64': (1200, 40)}
+
+
+def test_read_broken(store, tmpdir):
+    tmpdir.join('cache', 'rates.bin').write('HMRS\x01\x00\x05', ensure=True)
+    assert store.read() == {}
+    tmpdir.join('cache', 'rates.bin').write('text', ensure=True)
+    assert store.read() == {}
+
+
+def test_write_empty(store):
+    store.write({})
+    assert store.read() == {}
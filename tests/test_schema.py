@@ -3,7 +3,8 @@ import mock
 import os
 
 
-from monitoring.schema import Schema
+from monitoring.executor import TIMED_OUT
+from monitoring.schema import Schema, SchemaPool
 
 
 @pytest.fixture
@@ -75,8 +76,29 @@ def test_load_schema(schema_dir):
     assert isinstance(Schema.load_schema('test', schema_dir), Schema)
 
 
+def test_schema_pool(schema_dir):
+    pool = SchemaPool()
+    schema = pool.acquire('test', schema_dir)
+    other = pool.acquire('test', schema_dir)
+    assert schema is not other
+    pool.release('test', schema_dir, schema)
+    assert pool.acquire('test', schema_dir) is schema
+    assert pool.acquire('unknown', schema_dir) is None
+
+
+def test_schema_pool_reload(tmpdir, schema_dir):
+    filename = tmpdir.join('test.yaml')
+    with open(os.path.join(schema_dir, 'test.yaml')) as h:
+        filename.write(h.read())
+    pool = SchemaPool()
+    schema = pool.acquire('test', str(tmpdir))
+    pool.release('test', str(tmpdir), schema)
+    filename.setmtime(schema.mtime + 10)
+    assert pool.acquire('test', str(tmpdir)) is not schema
+
+
 def test_scan_without_request(schema):
-    assert schema.scan('1', 'unit') == {
+    assert schema.scan('1', 'unit').as_dict() == {
         'unit.test.memory.available': {
             'description': None,
             'name': 'unit.test.memory.available',
@@ -130,7 +152,7 @@ def test_scan(schema, response):
         return response
     schema.set_request_executor(executor)
 
-    assert schema.scan('1', 'unit') == {
+    assert schema.scan('1', 'unit').as_dict() == {
         'unit.test.memory.available': {
             'description': None,
             'name': 'unit.test.memory.available',
@@ -330,3 +352,132 @@ def test_get_value_no_data(schema):
 
 def test_get_value_no_address(schema, response):
     assert schema.get_value(response, None) == response
+
+
+def test_scan_batch_executor(schema, response):
+    requests = []
+
+    def executor(batch):
+        requests.extend(batch)
+        return [response] * len(batch)
+
+    schema.set_batch_executor(executor)
+    result = schema.scan('1', 'unit')
+    assert [x['query'] for x in requests] == ['/long/path']
+    assert result.get_value('unit.test.memory.used') == 100
+    assert schema.responses == {}
+
+
+def test_compile(schema):
+    compiled = schema.compile('1', 'unit')
+    assert schema.compile('1', 'unit') is compiled
+    assert schema.compile('2', 'unit') is not compiled
+
+
+def test_compile_path(schema, response):
+    accessors = schema.compile_path('table => 1 => runs => 0 => name')
+    assert len(accessors) == 5
+    assert schema.compile_path('table => 1 => runs => 0 => name') is accessors
+    assert schema.walk_path(response, accessors) == 'first'
+
+
+def test_scan_twice(schema, response):
+    schema.set_request_executor(lambda x, y: response)
+    first = schema.scan('1', 'unit')
+    first.add(first.get_meta('unit.test.memory.used'), 'changed')
+    assert schema.scan('1', 'unit').as_dict() == \
+        schema.scan('1', 'unit').as_dict()
+    assert schema.scan('1', 'unit').get_value('unit.test.memory.used') == 100
+
+
+def test_exec_function_filter_index(schema):
+    data = [{'name': 'first', 'count': 1},
+            {'name': 'first', 'count': 2},
+            {'name': 'second', 'count': 3}]
+    assert schema.exec_function_filter({'name': 'first'}, data) == data[0]
+    index = schema.get_filter_index(['name'], data)
+    assert schema.get_filter_index(['name'], data) is index
+    assert schema.exec_function_filter({'name': 'second'}, data) == data[2]
+
+
+def test_exec_function_filter_unhashable(schema):
+    data = [{'name': ['first'], 'count': 1},
+            {'name': 'second', 'count': 2}]
+    assert schema.get_filter_index(['name'], data) is None
+    assert schema.exec_function_filter({'name': 'second'}, data) == data[1]
+
+
+def test_scan_resets_filter_indexes(schema, response):
+    schema.set_request_executor(lambda x, y: response)
+    schema.scan('1', 'unit')
+    assert schema.filter_indexes == {}
+
+
+def test_get_request_paths(schema):
+    request = schema.schema['requests'][0]
+    assert schema.get_request_paths(request) == [('memory',), ('table',)]
+
+
+FIXTURES = [
+    ({'resources': [{'path': '=> a => b'}, {'path': '=> a => c => 0'}]},
+     [('a', 'b'), ('a', 'c')]),
+    ({'resources': [{'path': '=> a'}, {'path': '=> 0 => b'}]}, None),
+    ({'resources': [{'path': '=> a'}, {'path': None}]}, None),
+    ({'resources': [{'table': {'path': '=> t => filter(a=1)'}}]}, [('t',)]),
+    ({'requests': [{'query': '/', 'path': '=> a'}]}, []),
+]
+
+
+@pytest.mark.parametrize('request_node, expected', FIXTURES)
+def test_get_request_paths_nodes(schema, request_node, expected):
+    assert schema.get_request_paths(request_node) == expected
+
+
+def test_get_request_addresses(schema):
+    request = {'resources': [{'path': '=> beans => 0 => Used'},
+                             {'table': {'path': '=> t => filter(a=1)'}}]}
+    assert schema.get_request_addresses(request) == [
+        ['beans', '0', 'Used'], ['t', 'filter(a=1)']]
+
+
+def test_scan_timed_out(schema):
+    schema.set_request_executor(lambda x, y: TIMED_OUT)
+    result = schema.scan('1', 'unit')
+    assert sorted(result.keys()) == [
+        'unit.test.memory.available',
+        'unit.test.memory.used',
+        'unit.test.table-metric.count',
+        'unit.test.table-metric.index',
+        'unit.test.table-metric.name']
+    assert result.count_timeouts() == 5
+    assert all(x['timeout'] and x['value'] is None
+               for x in result.as_dict().values())
+
+
+def test_scan_shares_meta(schema, response):
+    schema.set_request_executor(lambda x, y: response)
+    first = schema.scan('1', 'unit')
+    second = schema.scan('1', 'unit')
+    assert sorted(first.keys()) == sorted(second.keys())
+    for name in first.keys():
+        assert first.get_meta(name) is second.get_meta(name)
+
+
+def test_scan_drops_gone_rows(schema, response):
+    schema.set_request_executor(lambda x, y: response)
+    schema.scan('1', 'unit')
+    rows = set(schema.last_row_metas)
+    assert rows
+    schema.last_row_metas[('unit.gone', 'application_1')] = None
+    schema.scan('1', 'unit')
+    assert set(schema.last_row_metas) == rows
+    assert schema.row_metas == {}
+
+
+def test_scan_row_index(schema, response):
+    schema.set_request_executor(lambda x, y: response)
+    result = schema.scan('1', 'unit')
+    meta = result.get_meta('unit.test.table-metric.index.2456940119')
+    assert meta.index == '2456940119'
+    assert meta.get_field_name() == 'unit.test.table-metric.index'
+    assert result.get_meta('unit.test.memory.used').index is None
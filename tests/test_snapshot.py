@@ -0,0 +1,84 @@
+import pytest
+import time
+
+from monitoring.formatter import SubagentOutputFormatter
+from monitoring.metrics import LeafMeta, Metrics
+from monitoring.snapshot import SnapshotFileReader, SnapshotFileWriter
+from monitoring.snapshot import read_snapshot
+
+
+@pytest.fixture
+def metrics():
+    result = Metrics()
+    result.add(LeafMeta('h.b.x', 'h.10.1', 'hBX'), u'caf\xe9')
+    result.add(LeafMeta('h.a', 'h.9', 'hA', 'Gauge32'), 1.5)
+    result.add(LeafMeta('h.b.y', 'h.10.2', 'hBY', 'Counter64'), 2 ** 40)
+    result.add(LeafMeta('h.c', 'h.11', 'hC'), None, timeout=True)
+    return result
+
+
+@pytest.fixture
+def filename(tmpdir):
+    return str(tmpdir.join('snapshot', 'hadoop.snapshot'))
+
+
+@pytest.mark.parametrize('pattern', ['*', 'h.b.*', 'h.a', 'h.d'])
+def test_subagent_output(metrics, filename, pattern):
+    SnapshotFileWriter(filename).update(metrics)
+    expected = SubagentOutputFormatter().output(metrics, pattern)
+    assert read_snapshot(filename, pattern).decode('utf-8') == expected
+
+
+def test_leaves(metrics, filename):
+    SnapshotFileWriter(filename).update(metrics)
+    reader = SnapshotFileReader(filename).open()
+    assert list(reader.leaves()) == [
+        ('h.a', 'h.9', 'hA', '1.5'),
+        ('h.b.x', 'h.10.1', 'hBX', 'caf\xc3\xa9'),
+        ('h.b.y', 'h.10.2', 'hBY', '1099511627776'),
+    ]
+    reader.close()
+
+
+def test_sequence(metrics, filename):
+    writer = SnapshotFileWriter(filename)
+    writer.update(metrics)
+    reader = SnapshotFileReader(filename).open()
+    assert reader.sequence == 1
+    writer.update(Metrics())
+    assert reader.count == 3
+    assert reader.open().sequence == 2
+    assert reader.count == 0
+    SnapshotFileWriter(filename).update(metrics)
+    assert reader.open().sequence == 3
+    reader.close()
+
+
+def test_unknown_format(filename, tmpdir):
+    tmpdir.join('snapshot', 'hadoop.snapshot').write('x' * 64, ensure=True)
+    with pytest.raises(ValueError):
+        SnapshotFileReader(filename).open()
+    writer = SnapshotFileWriter(filename)
+    writer.update(Metrics())
+    assert writer.sequence == 1
+
+
+@pytest.mark.parametrize('size', [0, 10, 40, 60, 100, -1])
+def test_truncated(metrics, filename, size):
+    SnapshotFileWriter(filename).update(metrics)
+    with open(filename, 'rb') as h:
+        data = h.read()
+    with open(filename, 'wb') as h:
+        h.write(data[:size])
+    with pytest.raises(ValueError):
+        read_snapshot(filename)
+
+
+def test_max_age(metrics, filename, monkeypatch):
+    SnapshotFileWriter(filename).update(metrics)
+    assert read_snapshot(filename, 'h.a', max_age=60) == 'hA = 1.5'
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    with pytest.raises(ValueError):
+        read_snapshot(filename, max_age=60)
+    assert read_snapshot(filename, 'h.a') == 'hA = 1.5'
@@ -0,0 +1,92 @@
+import pytest
+import StringIO
+
+from monitoring.metrics import LeafMeta, Metrics
+from monitoring.snmp import OIDIndex, PassPersistHandler, parse_oid
+
+
+@pytest.fixture
+def metrics():
+    result = Metrics()
+    for name, oid, kind, value in [
+            ('unit.test.memory.used', 'unit.1.2.1', 'Counter64', 100),
+            ('unit.test.memory.available', 'unit.1.2.2', 'Counter64', 200),
+            ('unit.test.table.name.10', 'unit.1.1.2.10', 'OCTET STRING',
+             'first'),
+            ('unit.test.table.index.10', 'unit.1.1.1.10', 'INTEGER', 10),
+            ('unit.test.table.index.9', 'unit.1.1.1.9', 'INTEGER', 9),
+            ('unit.test.unknown', 'unit.1.3', 'Gauge32', None)]:
+        result.add(LeafMeta(name, oid, name, kind), value)
+    return result
+
+
+@pytest.fixture
+def index(metrics):
+    return OIDIndex(metrics, '.1.3.6')
+
+
+FIXTURES = [
+    ('.1.3.6.1.2.1', ((1, 3, 6, 1, 2, 1), 'counter64', '100')),
+    ('.1.3.6.1.1.2.10', ((1, 3, 6, 1, 1, 2, 10), 'string', 'first')),
+    ('.1.3.6.1.1.1', None),
+    ('.1.3.6.1.3', None),
+]
+
+
+@pytest.mark.parametrize('oid, expected', FIXTURES)
+def test_get(index, oid, expected):
+    assert index.get(parse_oid(oid)) == expected
+
+
+FIXTURES = [
+    ('.1.3.6', (1, 3, 6, 1, 1, 1, 9)),
+    ('.1.3.6.1.1.1.9', (1, 3, 6, 1, 1, 1, 10)),
+    ('.1.3.6.1.1.1.10', (1, 3, 6, 1, 1, 2, 10)),
+    ('.1.3.6.1.1.3', (1, 3, 6, 1, 2, 1)),
+    ('.1.3.6.1.2.2', None),
+]
+
+
+@pytest.mark.parametrize('oid, expected', FIXTURES)
+def test_get_next(index, oid, expected):
+    entry = index.get_next(parse_oid(oid))
+    assert (entry and entry[0]) == expected
+
+
+FIXTURES = [
+    ('counter64', 10, '10'),
+    ('counter', -1, None),
+    ('gauge', 'text', None),
+    ('integer', -1, '-1'),
+    ('string', u'multi\nline', 'multi line'),
+]
+
+
+@pytest.mark.parametrize('kind, value, expected', FIXTURES)
+def test_format_value(index, kind, value, expected):
+    if expected is None:
+        with pytest.raises(ValueError):
+            index.format_value(kind, value)
+    else:
+        assert index.format_value(kind, value) == expected
+
+
+def test_pass_persist(metrics):
+    stdin = StringIO.StringIO(
+        'PING\n'
+        'get\n.1.3.6.1.2.2\n'
+        'getnext\n.1.3.6.1.2.2\n'
+        'get\n.1.3.6.1.2.3\n'
+        'set\n.1.3.6.1.2.2\ninteger 1\n'
+        'get\nbroken\n')
+    stdout = StringIO.StringIO()
+    handler = PassPersistHandler('.1.3.6', stdin, stdout)
+    handler.update(metrics)
+    handler.run()
+    assert stdout.getvalue() == (
+        'PONG\n'
+        '.1.3.6.1.2.2\ncounter64\n200\n'
+        'NONE\n'
+        'NONE\n'
+        'not-writable\n'
+        'NONE\n')